@@ -106,6 +106,14 @@ if any(v is None for v in [IMAGEKIT_PRIVATE_KEY, IMAGEKIT_PUBLIC_KEY, IMAGEKIT_U
     raise ValueError("ImageKit configuration missing in environment variables")
 
 BASE_URL = os.getenv('BASE_URL')
+
+# Where booking push notifications are queued: 'redis' (drained by the
+# run_push_worker command), 'memory' or 'inline' (sent in the request)
+PUSH_QUEUE_BACKEND = os.getenv('PUSH_QUEUE_BACKEND', 'redis')
+
+# Where in-flight booking requests live: 'database' (PendingRequests rows)
+# or 'redis' (only final outcomes are written to the database, in batches)
+PENDING_STORE_BACKEND = os.getenv('PENDING_STORE_BACKEND', 'database')
 DEBUG = os.getenv("DEBUG", "False").lower() in ("true", "1")
 ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "").split(",")
 
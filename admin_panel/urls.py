@@ -62,6 +62,7 @@ urlpatterns = [
     # =================== NOTIFICATION MANAGEMENT ===================
     path('api/notifications/tokens/', views.fcm_tokens_api, name='fcm_tokens_api'),
     path('api/notifications/send/', views.send_notification_api, name='send_notification_api'),
+    path('api/notifications/<str:broadcast_id>/', views.notification_status_api, name='notification_status_api'),
 
     # =================== COUPON MANAGEMENT ===================
     path('api/coupons/', views.admin_coupons_list_api, name='admin_coupons_list_api'),
@@ -12,10 +12,14 @@ from django.core.paginator import Paginator
 
 from User.models import UserProfile
 from booking.models import Booking, PendingRequests, FCMToken, Coupon
+from booking.notifications import enqueue_broadcast, get_broadcast_status, pruned_tokens_count
+from booking.pending_store import get_pending_store
 from therapist.models import TherapistStatus, Services as TherapistServices, TherapistAddress, BankDetails
 from customer.models import CustomerAddress
 from chat.models import Conversation, Message
 from api.models import Pictures
+from therapist.snapshot import get_snapshot
+from therapist import search_cache
 from .auth import SimpleAdminAuthentication
 from .serializers import AdminCouponSerializer, AdminCouponListSerializer
 
@@ -655,10 +659,7 @@ def live_monitoring_api(request):
             req['distance'] = float(req['distance'])
 
         # Available therapists
-        available_therapists = list(UserProfile.objects.filter(
-            role='therapist',
-            therapist_status__status='available'
-        ).values('id', 'name', 'email'))
+        available_therapists = get_snapshot().available_therapists()
 
         # System alerts
         alerts = []
@@ -917,6 +918,15 @@ def system_health_api(request):
             'status': 'good'
         })
 
+        # Therapist search cache effectiveness
+        search_cache_stats = search_cache.stats()
+        health_indicators.append({
+            'type': 'cache',
+            'metric': 'Search Cache Hit Rate',
+            'value': f"{search_cache_stats['hit_rate']:.1%}",
+            'status': 'good'
+        })
+
         # Overall system status
         critical_issues = len([i for i in health_indicators if i['status'] == 'critical'])
         system_status = 'critical' if critical_issues > 0 else 'healthy'
@@ -928,6 +938,8 @@ def system_health_api(request):
                 'db_stats': db_stats,
                 'activity_stats': activity_stats,
                 'health_indicators': health_indicators,
+                'search_cache': search_cache_stats,
+                'pruned_fcm_tokens': pruned_tokens_count(),
                 'uptime': {
                     'percentage': 99.9,
                     'last_incident': None
@@ -1220,7 +1232,11 @@ def customer_list_api(request):
 @authentication_classes([SimpleAdminAuthentication])
 @permission_classes([AllowAny])
 def pending_requests_api(request):
-    """List all pending booking requests"""
+    """
+    List all pending booking requests. With PENDING_STORE_BACKEND=redis
+    this reads Postgres only, so requests show up once they are answered
+    and flushed; act on one through pending_request_action_api.
+    """
     try:
         page = int(request.query_params.get('page', 1))
         per_page = int(request.query_params.get('per_page', 20))
@@ -1273,33 +1289,28 @@ def pending_requests_api(request):
 @authentication_classes([SimpleAdminAuthentication])
 @permission_classes([AllowAny])
 def pending_request_action_api(request, request_id):
-    """Take action on pending requests"""
+    """Take action on pending requests, wherever the pending request store keeps them"""
     try:
-        pending_req = PendingRequests.objects.get(id=request_id)
+        statuses = {'approve': 'approved', 'reject': 'rejected', 'cancel': 'cancelled'}
         action = request.data.get('action')
-
-        if action == 'approve':
-            pending_req.status = 'approved'
-            pending_req.save()
-            message = f'Request {pending_req.id} approved'
-        elif action == 'reject':
-            pending_req.status = 'rejected'
-            pending_req.save()
-            message = f'Request {pending_req.id} rejected'
-        elif action == 'cancel':
-            pending_req.status = 'cancelled'
-            pending_req.save()
-            message = f'Request {pending_req.id} cancelled'
-        else:
+        if action not in statuses:
             return Response({'error': 'Invalid action'}, status=status.HTTP_400_BAD_REQUEST)
 
+        store = get_pending_store()
+        pending_req = store.get(request_id)
+        if pending_req is None:
+            return Response({'error': 'Request not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not store.set_status(pending_req, statuses[action]):
+            return Response(
+                {'error': 'Request was answered or expired meanwhile, reload it and try again'},
+                status=status.HTTP_409_CONFLICT
+            )
+
         return Response({
             'success': True,
-            'message': message
+            'message': f'Request {pending_req.id} {statuses[action]}'
         }, status=status.HTTP_200_OK)
 
-    except PendingRequests.DoesNotExist:
-        return Response({'error': 'Request not found'}, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -1611,7 +1622,8 @@ def fcm_tokens_api(request):
             'success': True,
             'data': {
                 'tokens': tokens_data,
-                'total_count': len(tokens_data)
+                'total_count': len(tokens_data),
+                'pruned_count': pruned_tokens_count()
             }
         }, status=status.HTTP_200_OK)
 
@@ -1640,20 +1652,39 @@ def send_notification_api(request):
             target_users = UserProfile.objects.all()
 
         # Get FCM tokens for target users
-        tokens = FCMToken.objects.filter(user__in=target_users)
+        tokens_count = FCMToken.objects.filter(user__in=target_users).count()
 
-        # Here you would normally send the actual push notifications
-        # For now, we'll just return success with the count
+        # Sending happens in the push worker; poll the status endpoint for progress
+        broadcast_id = enqueue_broadcast(title, message, user_type, tokens_count=tokens_count)
 
         return Response({
             'success': True,
-            'message': f'Notification sent to {tokens.count()} users',
+            'message': f'Notification queued for {tokens_count} users',
             'data': {
+                'broadcast_id': broadcast_id,
                 'title': title,
                 'message': message,
                 'target_user_type': user_type,
-                'tokens_count': tokens.count()
+                'tokens_count': tokens_count
             }
+        }, status=status.HTTP_202_ACCEPTED)
+
+    except Exception as e:
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+@authentication_classes([SimpleAdminAuthentication])
+@permission_classes([AllowAny])
+def notification_status_api(request, broadcast_id):
+    """Progress and per-batch results of a broadcast notification"""
+    try:
+        broadcast = get_broadcast_status(broadcast_id)
+        if broadcast is None:
+            return Response({'error': 'Broadcast not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            'success': True,
+            'data': broadcast
         }, status=status.HTTP_200_OK)
 
     except Exception as e:
@@ -0,0 +1,114 @@
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.db import connection
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from .models import Booking
+
+POPULAR_SERVICES_LIMIT = 5
+POPULAR_SERVICES_DAYS = 30
+TREND_MONTHS = 12
+
+
+def _totals(revenue, orders):
+    revenue = revenue or Decimal('0.00')
+    return {
+        'total_revenue': float(revenue),
+        'total_orders': orders,
+        'average_order_value': float(revenue / orders) if orders > 0 else 0.0
+    }
+
+
+def period_totals(completed, now, periods):
+    """
+    Revenue and order counts of completed bookings over their whole life
+    and since now - days for each (name, days) period, in one query
+    """
+    aggregates = {'lifetime_revenue': Sum('total'), 'lifetime_orders': Count('id')}
+    for name, days in periods:
+        since = Q(completed_at__gte=now - timedelta(days=days))
+        aggregates[f'{name}_revenue'] = Sum('total', filter=since)
+        aggregates[f'{name}_orders'] = Count('id', filter=since)
+    row = completed.aggregate(**aggregates)
+    totals = {name: _totals(row[f'{name}_revenue'], row[f'{name}_orders']) for name, _ in periods}
+    totals['lifetime'] = _totals(row['lifetime_revenue'], row['lifetime_orders'])
+    return totals
+
+
+def _month_start(day, months_back):
+    month_index = day.year * 12 + day.month - 1 - months_back
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def daily_and_monthly(completed, now, days=7, months=TREND_MONTHS):
+    """
+    Revenue and orders for each of the last days days (newest first) and
+    the last months calendar months (oldest first), UTC, both rolled up
+    from one query grouped by completion date
+    """
+    today = now.astimezone(dt_timezone.utc).date()
+    first_month = _month_start(today, months - 1)
+    first_day = min(first_month, today - timedelta(days=days - 1))
+
+    by_day = {
+        row['day']: (row['revenue'], row['orders'])
+        for row in completed.filter(completed_at__gte=datetime.combine(first_day, time.min, tzinfo=dt_timezone.utc))
+        .annotate(day=TruncDate('completed_at', tzinfo=dt_timezone.utc))
+        .values('day')
+        .annotate(revenue=Sum('total'), orders=Count('id'))
+        .order_by()
+    }
+
+    daily = []
+    for i in range(days):
+        day = today - timedelta(days=i)
+        revenue, orders = by_day.get(day, (Decimal('0.00'), 0))
+        daily.append({
+            'date': day.strftime('%Y-%m-%d'),
+            'day_name': day.strftime('%A'),
+            'revenue': float(revenue),
+            'orders': orders
+        })
+
+    by_month = {}
+    for day, (revenue, orders) in by_day.items():
+        month = day.replace(day=1)
+        month_revenue, month_orders = by_month.get(month, (Decimal('0.00'), 0))
+        by_month[month] = (month_revenue + revenue, month_orders + orders)
+    monthly = []
+    for i in reversed(range(months)):
+        month = _month_start(today, i)
+        revenue, orders = by_month.get(month, (Decimal('0.00'), 0))
+        monthly.append({
+            'month': month.strftime('%Y-%m'),
+            'month_name': month.strftime('%B %Y'),
+            'revenue': float(revenue),
+            'orders': orders
+        })
+    return daily, monthly
+
+
+def popular_services(therapist_id, since, limit=POPULAR_SERVICES_LIMIT):
+    """
+    The therapist's most booked services among bookings completed since
+    since, counting each booking's quantity (1 when missing or not a
+    positive number), summed by Postgres over the keys of the services JSON
+    """
+    sql = f'''
+        SELECT service.key, SUM(
+            CASE WHEN service.value !~ '^[0-9]{{1,18}}$' THEN 1
+                 WHEN service.value::bigint > 0 THEN service.value::bigint
+                 ELSE 1 END
+        )::bigint AS booking_count
+        FROM "{Booking._meta.db_table}" booking
+        CROSS JOIN LATERAL jsonb_each_text(
+            CASE WHEN jsonb_typeof(booking.services) = 'object' THEN booking.services ELSE '{{}}'::jsonb END
+        ) AS service
+        WHERE booking.therapist_id = %s AND booking.status = 'completed' AND booking.completed_at >= %s
+        GROUP BY service.key
+        ORDER BY booking_count DESC, service.key
+        LIMIT %s
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [therapist_id, since, limit])
+        return [{'service_name': name, 'booking_count': count} for name, count in cursor.fetchall()]
@@ -0,0 +1,33 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def booking_group(user_id):
+    """Channel layer group every BookingEventsConsumer of a user joins"""
+    return f'bookings_{user_id}'
+
+
+def publish_booking_event(user_ids, event, data):
+    """
+    Send a booking event to the open ws/bookings/ sockets of each user once
+    the current transaction commits. event matches the "type" of the
+    corresponding push notification, e.g. "booking_request".
+    """
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        for user_id in user_ids:
+            try:
+                async_to_sync(channel_layer.group_send)(
+                    booking_group(user_id),
+                    {'type': 'booking_event', 'event': event, 'data': data}
+                )
+            except Exception as e:
+                logger.error(f"[BookingEvents] Could not publish {event} to user {user_id}: {e}")
+
+    transaction.on_commit(send)
@@ -0,0 +1,57 @@
+import logging
+from .events import publish_booking_event
+from .notifications import enqueue_push
+from .pending_store import get_pending_store
+
+logger = logging.getLogger(__name__)
+
+
+def _notify_expired(customer_id, therapist_id, request_id):
+    data = {"type": "booking_expired", "request_id": str(request_id)}
+    enqueue_push(
+        customer_id,
+        "Booking Request Expired",
+        "Your therapist did not respond in time",
+        data
+    )
+    enqueue_push(
+        therapist_id,
+        "Booking Request Expired",
+        "A booking request expired before you responded",
+        data
+    )
+    publish_booking_event([customer_id, therapist_id], 'booking_expired', {'request_id': str(request_id)})
+
+
+def expire_due_requests(batch_size=500, now=None):
+    """
+    Expire the oldest pending requests whose answer window has passed, at
+    most batch_size of them, and notify both parties of each. Requests are
+    taken oldest first. In Postgres, rows another sweeper or a response is
+    holding (a response locks its row when it sets the status) are skipped
+    and picked up on a later pass if still pending; in Redis each request is
+    taken atomically, so it is either expired here or answered, never both.
+    Returns how many requests were expired.
+    """
+    due = get_pending_store().expire_due(batch_size, now)
+    for request_id, customer_id, therapist_id in due:
+        _notify_expired(customer_id, therapist_id, request_id)
+    if due:
+        logger.info(f"[Expiry] Expired {len(due)} pending requests")
+    return len(due)
+
+
+def next_expiry():
+    """When the oldest still-pending request expires, or None if there is none"""
+    return get_pending_store().next_expiry()
+
+
+def flush_outcomes(batch_size=500):
+    """Write answered and expired requests held outside Postgres, returning how many were written"""
+    flushed = 0
+    store = get_pending_store()
+    while True:
+        count = store.flush(batch_size)
+        flushed += count
+        if count < batch_size:
+            return flushed
@@ -1,18 +1,48 @@
-from firebase_admin import messaging
+from firebase_admin import exceptions, messaging
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Errors meaning the token itself will never work again: the app was
+# uninstalled, or the token belongs to a different Firebase project.
+STALE_TOKEN_ERRORS = (messaging.UnregisteredError, messaging.SenderIdMismatchError)
+
+
+def is_stale_token_error(error):
+    """True when FCM rejected the token itself rather than the message or the request"""
+    if isinstance(error, STALE_TOKEN_ERRORS):
+        return True
+    # INVALID_ARGUMENT is also returned for malformed payloads, so only a
+    # complaint about the registration token counts
+    return isinstance(error, exceptions.InvalidArgumentError) and 'registration token' in str(error).lower()
+
+
+def send_message(token, title, body, data=None):
+    """Send to one device, raising the FCM error on failure"""
+    message = messaging.Message(
+        notification=messaging.Notification(title=title, body=body),
+        data=data or {},
+        token=token,
+    )
+    response = messaging.send(message)
+    logger.info(f"Successfully sent message: {response}")
+    return response
+
+
 def send_push_notification(token, title, body, data=None):
     try:
-        message = messaging.Message(
-            notification=messaging.Notification(title=title, body=body),
-            data=data or {},
-            token=token,
-        )
-        response = messaging.send(message)
-        logger.info(f"Successfully sent message: {response}")
+        send_message(token, title, body, data)
         return True
     except Exception as e:
         logger.error(f"Error sending FCM message: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def send_multicast(tokens, title, body, data=None):
+    """Send one notification to up to 500 tokens in a single FCM batch request"""
+    message = messaging.MulticastMessage(
+        notification=messaging.Notification(title=title, body=body),
+        data=data or {},
+        tokens=tokens,
+    )
+    return messaging.send_each_for_multicast(message)
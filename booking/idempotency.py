@@ -0,0 +1,92 @@
+import functools
+import hashlib
+import json
+import logging
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# Long enough to cover a client's retries, short enough that a key can be
+# reused once the request it named is long gone
+TTL_SECONDS = 15 * 60
+# Upper bound on how long the first request with a key may run before a
+# retry is allowed to run it again
+LOCK_SECONDS = 30
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def idempotent(view):
+    """
+    Let clients retry a POST safely by sending an Idempotency-Key header.
+    The first response for a user and key is kept for TTL_SECONDS and
+    replayed to every retry without running the view again, so nothing is
+    written or notified twice. A retry that arrives while the first request
+    is still running gets a 409, and reusing a key with a different body a
+    422. Requests without the header, or made while the cache is
+    unreachable, run the view as usual.
+
+    Goes below @api_view and @permission_classes so request.user is set.
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'Idempotency-Key must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        cache_key = f'idempotency:{view.__name__}:{request.user.id}:{digest}'
+        lock_key = f'{cache_key}:lock'
+        fingerprint = _fingerprint(request)
+        try:
+            saved = cache.get(cache_key)
+            locked = saved is None and not cache.add(lock_key, 1, timeout=LOCK_SECONDS)
+        except Exception as e:
+            logger.warning(f"[Idempotency] Cache unavailable, running {view.__name__} without a key: {e}")
+            return view(request, *args, **kwargs)
+
+        if saved is not None:
+            if saved['fingerprint'] != fingerprint:
+                return Response(
+                    {'error': 'Idempotency-Key was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            return Response(saved['data'], status=saved['status'], headers={REPLAYED_HEADER: 'true'})
+        if locked:
+            return Response(
+                {'error': 'A request with this Idempotency-Key is still being processed'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            response = view(request, *args, **kwargs)
+            # Server errors are not final; the client should be able to retry them
+            if response.status_code < 500:
+                try:
+                    cache.set(cache_key, {
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'data': response.data,
+                    }, timeout=TTL_SECONDS)
+                except Exception as e:
+                    logger.warning(f"[Idempotency] Could not save response for {view.__name__}: {e}")
+            return response
+        finally:
+            try:
+                cache.delete(lock_key)
+            except Exception as e:
+                logger.warning(f"[Idempotency] Could not release lock for {view.__name__}: {e}")
+
+    return wrapper
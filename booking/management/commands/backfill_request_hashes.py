@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from booking.models import PendingRequests
+
+
+class Command(BaseCommand):
+    help = 'Compute duplicate-check hashes for pending requests that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        qs = PendingRequests.objects.filter(request_hash__isnull=True)
+
+        batch = []
+        updated = 0
+        for pending in qs.iterator(chunk_size=batch_size):
+            pending.request_hash = pending.compute_hash()
+            batch.append(pending)
+            if len(batch) >= batch_size:
+                PendingRequests.objects.bulk_update(batch, ['request_hash'])
+                updated += len(batch)
+                batch = []
+        if batch:
+            PendingRequests.objects.bulk_update(batch, ['request_hash'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated request hashes for {updated} pending requests'))
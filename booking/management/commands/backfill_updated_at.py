@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.db.models.functions import Coalesce, Greatest
+from booking.models import Booking, PendingRequests
+
+
+class Command(BaseCommand):
+    help = 'Set updated_at on bookings and pending requests saved before that column existed'
+
+    def handle(self, *args, **options):
+        # The latest time each row is known to have been written
+        bookings = Booking.objects.filter(updated_at__isnull=True).update(
+            updated_at=Greatest(
+                'created_at',
+                Coalesce('started_at', 'created_at'),
+                Coalesce('completed_at', 'created_at'),
+                Coalesce('cancelled_at', 'created_at'),
+            )
+        )
+        pending = PendingRequests.objects.filter(updated_at__isnull=True).update(updated_at=F('created_at'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Updated updated_at for {bookings} bookings and {pending} pending requests'
+        ))
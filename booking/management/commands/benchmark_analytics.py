@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from booking.models import Booking
+from booking.views import therapist_analytics
+from therapist.models import Services
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Time therapist_analytics for a therapist with many completed bookings. The data is created '
+        'in a transaction that is rolled back, so this is safe to run against a development database'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bookings', type=int, default=10000)
+        parser.add_argument('--runs', type=int, default=50)
+        parser.add_argument('--max-p95-ms', type=float, help='Fail if p95 latency is above this')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            therapist = self._seed(options['bookings'])
+            timings, queries = self._measure(therapist, options['runs'])
+            transaction.set_rollback(True)
+
+        timings.sort()
+        p50 = statistics.median(timings)
+        p95 = timings[min(len(timings) - 1, int(round(0.95 * len(timings))) - 1)]
+        self.stdout.write(
+            f'{options["bookings"]} completed bookings, {options["runs"]} runs, {queries} queries per call: '
+            f'p50 {p50:.1f}ms, p95 {p95:.1f}ms, max {timings[-1]:.1f}ms'
+        )
+        if options['max_p95_ms'] is not None and p95 > options['max_p95_ms']:
+            raise CommandError(f'p95 {p95:.1f}ms is above {options["max_p95_ms"]}ms')
+
+    def _seed(self, count):
+        suffix = uuid.uuid4().hex[:8]
+        therapist = User.objects.create_user(
+            name='Benchmark Therapist', email=f'benchmark-therapist-{suffix}@example.com',
+            password=uuid.uuid4().hex, role='therapist'
+        )
+        customer = User.objects.create_user(
+            name='Benchmark Customer', email=f'benchmark-customer-{suffix}@example.com',
+            password=uuid.uuid4().hex, role='customer'
+        )
+        codes = [code for code, _ in Services.SERVICE_CHOICES]
+        now = timezone.now()
+        rng = random.Random(0)
+        bookings = []
+        for _ in range(count):
+            completed_at = now - timedelta(minutes=rng.randrange(0, 400 * 24 * 60))
+            total = Decimal(rng.randrange(500, 5000))
+            bookings.append(Booking(
+                customer=customer, therapist=therapist,
+                time_slot_from=completed_at - timedelta(hours=1), time_slot_to=completed_at,
+                services={code: rng.randint(1, 2) for code in rng.sample(codes, rng.randint(1, 3))},
+                subtotal=total, total=total, status='completed', completed_at=completed_at
+            ))
+        Booking.objects.bulk_create(bookings, batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE "{Booking._meta.db_table}"')
+        return therapist
+
+    def _measure(self, therapist, runs):
+        factory = APIRequestFactory()
+
+        def call():
+            request = factory.get('/booking/analytics/')
+            force_authenticate(request, user=therapist)
+            response = therapist_analytics(request)
+            if response.status_code != 200:
+                raise CommandError(f'therapist_analytics returned {response.status_code}')
+
+        with CaptureQueriesContext(connection) as ctx:
+            call()
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, len(ctx.captured_queries)
@@ -0,0 +1,77 @@
+import ast
+import json
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from booking.models import Booking, PendingRequests
+
+
+def _to_json(raw):
+    """JSON for a services value saved as str(dict), or None if it cannot be read"""
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            value = parse(raw)
+        except (ValueError, SyntaxError, TypeError):
+            continue
+        if isinstance(value, dict):
+            return json.dumps(value)
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Rewrite booking services saved as Python dict reprs into JSON. Run before migrate: the '
+        'PendingRequests.services column can only become jsonb once every row holds valid JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending_table = PendingRequests._meta.db_table
+        booking_table = Booking._meta.db_table
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = 'services'",
+                [pending_table]
+            )
+            row = cursor.fetchone()
+        if row is None:
+            self.stdout.write('No booking tables yet, nothing to convert')
+            return
+        if row[0] == 'text':
+            converted = self._convert(
+                f'SELECT id, services FROM "{pending_table}"',
+                f'UPDATE "{pending_table}" SET services = %s WHERE id = %s',
+                batch_size
+            )
+            self.stdout.write(self.style.SUCCESS(f'Converted services of {converted} pending requests'))
+        else:
+            self.stdout.write('Pending request services are already stored as JSON')
+
+        # Accepting a request copied the repr string into Booking.services as a JSON string
+        converted = self._convert(
+            f"SELECT id, services #>> '{{}}' FROM \"{booking_table}\" WHERE jsonb_typeof(services) = 'string'",
+            f'UPDATE "{booking_table}" SET services = %s::jsonb WHERE id = %s',
+            batch_size
+        )
+        self.stdout.write(self.style.SUCCESS(f'Converted services of {converted} bookings'))
+
+    def _convert(self, select_sql, update_sql, batch_size):
+        with connection.cursor() as cursor:
+            cursor.execute(select_sql)
+            rows = cursor.fetchall()
+
+        updates = []
+        for row_id, raw in rows:
+            value = _to_json(raw)
+            if value is None:
+                self.stderr.write(f'Could not read services of {row_id}: {raw!r}, storing {{}}')
+                value = '{}'
+            updates.append((value, row_id))
+
+        for start in range(0, len(updates), batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(update_sql, updates[start:start + batch_size])
+        return len(updates)
@@ -0,0 +1,47 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+from booking.expiry import expire_due_requests, flush_outcomes, next_expiry
+
+
+class Command(BaseCommand):
+    help = 'Expire pending booking requests that were not answered in time and save outcomes kept in Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Longest time in seconds to sleep between sweeps')
+        parser.add_argument('--once', action='store_true', help='Expire everything due now, then exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        interval = options['interval']
+        while True:
+            expired = 0
+            try:
+                # Keep going while full batches come back: there is a backlog
+                while True:
+                    count = expire_due_requests(batch_size)
+                    expired += count
+                    if count < batch_size:
+                        break
+                flush_outcomes(batch_size)
+                due = next_expiry()
+            except Exception as e:
+                self.stderr.write(f'Expiry sweep failed: {e}')
+                due = None
+            finally:
+                close_old_connections()
+
+            if expired:
+                self.stdout.write(f'Expired {expired} pending requests')
+            if options['once']:
+                break
+
+            # Sleep until the oldest pending request is due, but wake up at
+            # least every interval to pick up requests created meanwhile
+            delay = interval
+            if due is not None:
+                delay = min(interval, max(0.5, (due - timezone.now()).total_seconds()))
+            time.sleep(delay)
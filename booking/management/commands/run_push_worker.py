@@ -0,0 +1,43 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from booking.notifications import get_queue, process, resume_stalled_broadcasts
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued push notifications, retrying failed ones with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--timeout', type=int, default=5, help='Seconds to block waiting for a job')
+
+    def handle(self, *args, **options):
+        queue = get_queue()
+        self.stdout.write(self.style.SUCCESS('Push worker started'))
+        try:
+            resumed = resume_stalled_broadcasts(queue)
+            if resumed:
+                self.stdout.write(f'Resumed {resumed} stalled broadcasts')
+        except Exception as e:
+            self.stderr.write(f'Could not resume stalled broadcasts: {e}')
+        delivered = 0
+        while True:
+            try:
+                job = queue.pop(timeout=options['timeout'])
+            except Exception as e:
+                self.stderr.write(f'Could not read push queue: {e}')
+                time.sleep(options['timeout'])
+                continue
+
+            if job is None:
+                if options['burst']:
+                    break
+                continue
+
+            try:
+                if process(job, queue):
+                    delivered += 1
+            finally:
+                close_old_connections()
+
+        self.stdout.write(self.style.SUCCESS(f'Delivered {delivered} push notifications'))
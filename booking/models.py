@@ -1,4 +1,8 @@
+import hashlib
+import json
 import uuid
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
@@ -39,6 +43,24 @@ class Coupon(models.Model):
             (self.usage_limit is None or self.used_count < self.usage_limit)
         )
 
+    def redeem(self):
+        """
+        Count one use of the coupon if it is still valid, in a single
+        conditional UPDATE so concurrent redemptions can never take it past
+        usage_limit. Returns whether the use was counted.
+        """
+        now = timezone.now()
+        redeemed = Coupon.objects.filter(
+            models.Q(usage_limit__isnull=True) | models.Q(used_count__lt=models.F('usage_limit')),
+            pk=self.pk,
+            is_active=True,
+            valid_from__lte=now,
+            valid_until__gte=now
+        ).update(used_count=models.F('used_count') + 1, updated_at=now)
+        if redeemed:
+            self.used_count += 1
+        return bool(redeemed)
+
     def can_apply_to_amount(self, amount):
         return amount >= self.minimum_order_amount
 
@@ -56,34 +78,74 @@ class Coupon(models.Model):
 
         return min(discount, amount)
 
+# How long a therapist has to answer a booking request before it expires
+PENDING_REQUEST_TTL = timedelta(minutes=2)
+
 class PendingRequests(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     customer_id = models.CharField(max_length=36, db_index=True)
     therapist_id = models.CharField(max_length=36, db_index=True)
     status = models.CharField(max_length=20, db_index=True)
     customer_name = models.CharField(max_length=255)
-    services = models.TextField()
+    # {service name: quantity}, as sent by the customer
+    services = models.JSONField(default=dict)
     coupon_code = models.CharField(max_length=50, blank=True, null=True)
     timeslot_from = models.DateTimeField(db_index=True)
     timeslot_to = models.DateTimeField(db_index=True)
     latitude = models.DecimalField(max_digits=9, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
     distance = models.DecimalField(max_digits=9, decimal_places=6)
+    # Fingerprint of the request details, see hash_request()
+    request_hash = models.CharField(max_length=64, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every write, for the /booking/changes/ feed; .update() calls set it themselves
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['therapist_id', 'status']),
             models.Index(fields=['customer_id', 'status']),
+            # Lets the expiry sweeper read due requests oldest first
+            models.Index(fields=['status', 'created_at']),
+            # Keyset pages of a user's requests, see booking.pagination
+            models.Index(fields=['therapist_id', 'created_at', 'id']),
+            models.Index(fields=['customer_id', 'created_at', 'id']),
         ]
         ordering = ['-created_at']
 
+    @staticmethod
+    def hash_request(customer_id, therapist_id, services, timeslot_from, timeslot_to, latitude, longitude, distance):
+        """
+        SHA-256 of the canonical form of a request, so two requests with the
+        same details hash alike however their services were ordered or their
+        timestamps and coordinates were written.
+        """
+        def decimal(value):
+            return str(Decimal(str(value)).quantize(Decimal('0.000001')))
+
+        canonical = json.dumps([
+            str(customer_id),
+            str(therapist_id),
+            sorted((str(name), quantity) for name, quantity in (services or {}).items()),
+            timeslot_from.astimezone(dt_timezone.utc).isoformat(),
+            timeslot_to.astimezone(dt_timezone.utc).isoformat(),
+            decimal(latitude),
+            decimal(longitude),
+            decimal(distance),
+        ], separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def compute_hash(self):
+        return self.hash_request(
+            self.customer_id, self.therapist_id, self.services, self.timeslot_from, self.timeslot_to,
+            self.latitude, self.longitude, self.distance
+        )
+
     def is_expired(self):
         """Check if request is older than 2 minutes and still pending"""
-        from datetime import timedelta
         if self.status != 'pending':
             return False
-        expiry_time = self.created_at + timedelta(minutes=2)
+        expiry_time = self.created_at + PENDING_REQUEST_TTL
         return timezone.now() > expiry_time
 
     def auto_expire_if_needed(self):
@@ -120,6 +182,8 @@ class Booking(models.Model):
     longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     distance = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every write, for the /booking/changes/ feed; .update() calls set it themselves
+    updated_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     cancelled_at = models.DateTimeField(null=True, blank=True)
@@ -129,6 +193,11 @@ class Booking(models.Model):
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['therapist', 'status']),
             models.Index(fields=['customer', 'status']),
+            # Keyset pages of a user's bookings, see booking.pagination
+            models.Index(fields=['therapist', 'created_at', 'id']),
+            models.Index(fields=['customer', 'created_at', 'id']),
+            # therapist_analytics ranges over a therapist's completed bookings
+            models.Index(fields=['therapist', 'status', 'completed_at']),
         ]
         ordering = ['-created_at']
 
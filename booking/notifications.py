@@ -0,0 +1,486 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+from django_redis import get_redis_connection
+from .firebase_utils import is_stale_token_error, send_message, send_multicast
+from .models import FCMToken
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'push:queue'
+DELAYED_KEY = 'push:delayed'
+PRUNED_KEY = 'push:pruned-tokens'
+
+# A failed delivery is retried after 5s, 10s, 20s, 40s, then dropped
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 5
+
+# Broadcasts go out in FCM's maximum batch size, one queued job per batch.
+# The audience is cut into token id ranges of that size when the broadcast
+# is queued, and up to BROADCAST_CONCURRENCY of those ranges are queued at
+# a time, so that many workers can send one concurrently while booking
+# pushes queued meanwhile wait behind only the batches in flight. Progress
+# is kept in Redis for the admin panel to poll, and a broadcast without
+# progress for BROADCAST_STALL_SECONDS is resumed when a worker starts.
+BROADCAST_BATCH_SIZE = 500
+BROADCAST_CONCURRENCY = 4
+BROADCAST_STATUS_TTL = 60 * 60 * 24
+BROADCAST_STALL_SECONDS = 5 * 60
+BROADCAST_ROLES = {'customers': 'customer', 'therapists': 'therapist'}
+BROADCASTS_KEY = 'push:broadcasts'
+
+
+class RedisPushQueue:
+    """
+    Jobs wait in a Redis list for the run_push_worker command. Jobs to be
+    retried wait in a sorted set scored by the time they become due, and
+    are moved back onto the list once that time has passed.
+    """
+
+    def _conn(self):
+        return get_redis_connection('default')
+
+    def push(self, job):
+        self._conn().lpush(QUEUE_KEY, json.dumps(job))
+
+    def schedule(self, job, delay):
+        self._conn().zadd(DELAYED_KEY, {json.dumps(job): time.time() + delay})
+
+    def _promote_due(self, conn):
+        for raw in conn.zrangebyscore(DELAYED_KEY, 0, time.time()):
+            # zrem succeeds for exactly one worker, so a job is never requeued twice
+            if conn.zrem(DELAYED_KEY, raw):
+                conn.lpush(QUEUE_KEY, raw)
+
+    def pop(self, timeout=5):
+        conn = self._conn()
+        self._promote_due(conn)
+        item = conn.brpop(QUEUE_KEY, timeout=timeout)
+        return json.loads(item[1]) if item else None
+
+
+class MemoryPushQueue:
+    """Process-local stand-in for the Redis queue, for tests and local runs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = deque()
+        self.delayed = []
+
+    def push(self, job):
+        with self._lock:
+            self.jobs.append(job)
+
+    def schedule(self, job, delay):
+        with self._lock:
+            self.delayed.append((time.time() + delay, job))
+
+    def pop(self, timeout=0):
+        with self._lock:
+            now = time.time()
+            self.jobs.extend(job for due, job in self.delayed if due <= now)
+            self.delayed = [(due, job) for due, job in self.delayed if due > now]
+            return self.jobs.popleft() if self.jobs else None
+
+    def clear(self):
+        with self._lock:
+            self.jobs.clear()
+            self.delayed = []
+
+
+class InlinePushQueue:
+    """Delivers on the spot, for development setups without a worker"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def push(self, job):
+        # Jobs pushed while processing, like a broadcast's next batch, run
+        # after the current one instead of recursing into it
+        jobs = getattr(self._local, 'jobs', None)
+        if jobs is not None:
+            jobs.append(job)
+            return
+        self._local.jobs = deque([job])
+        try:
+            while self._local.jobs:
+                process(self._local.jobs.popleft(), self)
+        finally:
+            self._local.jobs = None
+
+    def schedule(self, job, delay):
+        logger.warning(f"[PushQueue] Dropping push for user {job['user_id']}, no worker to retry it")
+
+    def pop(self, timeout=0):
+        return None
+
+
+memory_queue = MemoryPushQueue()
+_queues = {
+    'redis': RedisPushQueue(),
+    'memory': memory_queue,
+    'inline': InlinePushQueue(),
+}
+
+
+def get_queue():
+    return _queues[settings.PUSH_QUEUE_BACKEND]
+
+
+def enqueue_push(user_id, title, body, data=None):
+    """
+    Queue a push notification for a user. The job is only queued once the
+    surrounding transaction commits, so the worker never notifies about
+    rows it cannot see yet, and nothing is sent if the request fails.
+    """
+    job = {
+        'user_id': user_id,
+        'title': title,
+        'body': body,
+        'data': data or {},
+        'attempts': 0,
+    }
+
+    def push():
+        try:
+            get_queue().push(job)
+        except Exception as e:
+            logger.error(f"[PushQueue] Could not queue push for user {user_id}: {e}")
+
+    transaction.on_commit(push)
+
+
+def prune_tokens(tokens):
+    """Delete the (id, token) pairs FCM reported as dead and return how many rows went"""
+    if not tokens:
+        return 0
+    # Looked up by id, but the token must still match: a user who
+    # re-registered in the meantime has a new token on the same row, which
+    # must survive
+    ids = [token_id for token_id, _ in tokens]
+    values = [token for _, token in tokens]
+    pruned, _ = FCMToken.objects.filter(id__in=ids, token__in=values).delete()
+    if pruned:
+        logger.info(f"[PushQueue] Pruned {pruned} stale FCM tokens")
+        try:
+            try:
+                cache.incr(PRUNED_KEY, pruned)
+            except ValueError:
+                cache.add(PRUNED_KEY, 0, timeout=None)
+                cache.incr(PRUNED_KEY, pruned)
+        except Exception as e:
+            logger.warning(f"[PushQueue] Could not count pruned tokens: {e}")
+    return pruned
+
+
+def pruned_tokens_count():
+    """Total stale tokens pruned since the counter was created"""
+    try:
+        return cache.get(PRUNED_KEY, 0)
+    except Exception as e:
+        logger.warning(f"[PushQueue] Could not read pruned token count: {e}")
+        return 0
+
+
+def deliver(job):
+    """Send one queued push, returning False when it should be retried"""
+    row = FCMToken.objects.filter(user_id=job['user_id']).values_list('id', 'token').first()
+    if row is None:
+        # The user has no device registered; there is nothing to retry
+        return True
+    _, token = row
+    try:
+        send_message(token, job['title'], job['body'], job['data'])
+    except Exception as e:
+        if is_stale_token_error(e):
+            prune_tokens([row])
+            return True
+        logger.error(f"[PushQueue] Error sending FCM message to user {job['user_id']}: {e}")
+        return False
+    return True
+
+
+def broadcast_key(broadcast_id):
+    return f'push:broadcast:{broadcast_id}'
+
+
+def _batches_key(broadcast_id):
+    return f'push:broadcast:{broadcast_id}:batches'
+
+
+def _sent_key(broadcast_id):
+    return f'push:broadcast:{broadcast_id}:sent'
+
+
+def _broadcast_conn():
+    return get_redis_connection('default')
+
+
+def get_broadcast_status(broadcast_id):
+    conn = _broadcast_conn()
+    with conn.pipeline() as pipe:
+        pipe.hgetall(broadcast_key(broadcast_id))
+        pipe.lrange(_batches_key(broadcast_id), 0, -1)
+        fields, batches = pipe.execute()
+    if not fields:
+        return None
+    fields = {name.decode(): value.decode() for name, value in fields.items()}
+    state = {
+        'id': broadcast_id,
+        'status': fields['status'],
+        'title': fields['title'],
+        'body': fields['body'],
+        'user_type': fields['user_type'],
+        'tokens_count': int(fields['tokens_count']) if fields['tokens_count'] else None,
+        'sent': int(fields['sent']),
+        'failed': int(fields['failed']),
+        'pruned': int(fields['pruned']),
+        'batches_total': len(json.loads(fields['ranges'])),
+        'batches': [json.loads(entry) for entry in batches],
+        'updated_at': float(fields['updated_at']),
+    }
+    if 'error' in fields:
+        state['error'] = fields['error']
+    return state
+
+
+def _audience(user_type):
+    tokens = FCMToken.objects.all()
+    role = BROADCAST_ROLES.get(user_type)
+    if role is not None:
+        tokens = tokens.filter(user__role=role)
+    return tokens
+
+
+def _batch_ranges(user_type):
+    """
+    Split the audience as it is now into (after, upto] token id ranges of
+    at most BROADCAST_BATCH_SIZE tokens each, without loading every id
+    """
+    tokens = _audience(user_type)
+    last = tokens.aggregate(last=Max('id'))['last']
+    if last is None:
+        return []
+    ends = list(
+        tokens.annotate(position=Window(RowNumber(), order_by=F('id').asc()))
+        .annotate(offset=F('position') % BROADCAST_BATCH_SIZE)
+        .filter(offset=0)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    if not ends or ends[-1] != last:
+        ends.append(last)
+    return list(zip([0] + ends[:-1], ends))
+
+
+def _token_batch(user_type, after, upto):
+    """The (id, token) pairs of the audience in the token id range (after, upto], in id order"""
+    return list(_audience(user_type).filter(id__gt=after, id__lte=upto).order_by('id').values_list('id', 'token'))
+
+
+def _broadcast_job(broadcast_id, fields, ranges, index):
+    after, upto = ranges[index]
+    return {
+        'kind': 'broadcast',
+        'broadcast_id': broadcast_id,
+        'title': fields['title'],
+        'body': fields['body'],
+        'user_type': fields['user_type'],
+        'batch': index + 1,
+        'after': after,
+        'upto': upto,
+    }
+
+
+def _finish_broadcast(conn, broadcast_id, status, error=None):
+    fields = {'status': status, 'updated_at': time.time()}
+    if error is not None:
+        fields['error'] = error
+    with conn.pipeline() as pipe:
+        pipe.hset(broadcast_key(broadcast_id), mapping=fields)
+        pipe.srem(BROADCASTS_KEY, broadcast_id)
+        pipe.execute()
+
+
+def enqueue_broadcast(title, body, user_type='all', tokens_count=None):
+    """Queue a notification to every device of the given audience and return its broadcast id"""
+    broadcast_id = uuid.uuid4().hex
+    ranges = _batch_ranges(user_type)
+    fields = {
+        'title': title,
+        'body': body,
+        'user_type': user_type,
+        'tokens_count': '' if tokens_count is None else tokens_count,
+        'status': 'queued' if ranges else 'done',
+        'sent': 0,
+        'failed': 0,
+        'pruned': 0,
+        'ranges': json.dumps(ranges),
+        # How many ranges have been queued, and how many have been sent
+        'queued': min(len(ranges), BROADCAST_CONCURRENCY),
+        'finished': 0,
+        'updated_at': time.time(),
+    }
+    conn = _broadcast_conn()
+    with conn.pipeline() as pipe:
+        pipe.hset(broadcast_key(broadcast_id), mapping=fields)
+        pipe.expire(broadcast_key(broadcast_id), BROADCAST_STATUS_TTL)
+        if ranges:
+            pipe.sadd(BROADCASTS_KEY, broadcast_id)
+        pipe.execute()
+    queue = get_queue()
+    for index in range(fields['queued']):
+        queue.push(_broadcast_job(broadcast_id, fields, ranges, index))
+    return broadcast_id
+
+
+def _send_batch(job, batch):
+    """Send the job's batch and return its entry for the broadcast's status"""
+    entry = {'batch': job['batch'], 'size': len(batch), 'pruned': 0}
+    try:
+        response = send_multicast([token for _, token in batch], job['title'], job['body'])
+    except Exception as e:
+        logger.error(f"[PushQueue] Broadcast {job['broadcast_id']} batch {job['batch']} failed: {e}")
+        entry['success'] = 0
+        entry['failure'] = len(batch)
+        entry['error'] = str(e)
+        return entry
+    entry['success'] = response.success_count
+    entry['failure'] = response.failure_count
+    # responses line up with the tokens the batch was sent to
+    dead = [
+        pair for pair, result in zip(batch, response.responses)
+        if not result.success and is_stale_token_error(result.exception)
+    ]
+    entry['pruned'] = prune_tokens(dead)
+    return entry
+
+
+def _queue_next_range(conn, broadcast_id, fields, ranges, queue):
+    """Queue the first range no job has been queued for yet, if any is left"""
+    index = conn.hincrby(broadcast_key(broadcast_id), 'queued', 1) - 1
+    if index < len(ranges):
+        queue.push(_broadcast_job(broadcast_id, fields, ranges, index))
+
+
+def run_broadcast(job, queue):
+    """
+    Send one batch of a broadcast, record its outcome and queue the next
+    range not queued yet, so BROADCAST_CONCURRENCY batches stay in flight.
+    The job sending the last outstanding batch marks the broadcast done. A
+    job whose batch was already sent, as after a resume, does nothing.
+    """
+    broadcast_id = job['broadcast_id']
+    conn = _broadcast_conn()
+    status, ranges = conn.hmget(broadcast_key(broadcast_id), ['status', 'ranges'])
+    if status is None or status.decode() in ('done', 'failed'):
+        return
+    if conn.sismember(_sent_key(broadcast_id), job['batch']):
+        logger.info(f"[PushQueue] Skipping batch {job['batch']} of broadcast {broadcast_id}, already sent")
+        return
+    conn.hset(broadcast_key(broadcast_id), 'status', 'running')
+
+    try:
+        batch = _token_batch(job['user_type'], job['after'], job['upto'])
+    except Exception as e:
+        logger.error(f"[PushQueue] Broadcast {broadcast_id} stopped: {e}")
+        _finish_broadcast(conn, broadcast_id, 'failed', str(e))
+        return
+
+    entry = _send_batch(job, batch)
+    # Only the first job to record a batch counts it, should a resumed
+    # copy have sent it as well
+    if not conn.sadd(_sent_key(broadcast_id), job['batch']):
+        return
+    with conn.pipeline() as pipe:
+        key = broadcast_key(broadcast_id)
+        pipe.hincrby(key, 'sent', entry['success'])
+        pipe.hincrby(key, 'failed', entry['failure'])
+        pipe.hincrby(key, 'pruned', entry['pruned'])
+        pipe.hset(key, 'updated_at', time.time())
+        pipe.rpush(_batches_key(broadcast_id), json.dumps(entry))
+        pipe.expire(_batches_key(broadcast_id), BROADCAST_STATUS_TTL)
+        pipe.expire(_sent_key(broadcast_id), BROADCAST_STATUS_TTL)
+        pipe.hincrby(key, 'finished', 1)
+        finished = pipe.execute()[-1]
+
+    ranges = json.loads(ranges)
+    if finished < len(ranges):
+        _queue_next_range(conn, broadcast_id, job, ranges, queue)
+        return
+
+    _finish_broadcast(conn, broadcast_id, 'done')
+    state = get_broadcast_status(broadcast_id)
+    logger.info(
+        f"[PushQueue] Broadcast {broadcast_id} finished: {state['sent']} sent, {state['failed']} failed, "
+        f"{state['pruned']} stale tokens pruned"
+    )
+
+
+def resume_stalled_broadcasts(queue):
+    """
+    Requeue every batch already handed out but not sent of each unfinished
+    broadcast that has made no progress for BROADCAST_STALL_SECONDS, such
+    as those a dead worker was holding. Returns how many were resumed.
+    """
+    conn = _broadcast_conn()
+    try:
+        tracked = [broadcast_id.decode() for broadcast_id in conn.smembers(BROADCASTS_KEY)]
+    except Exception as e:
+        logger.warning(f"[PushQueue] Could not read tracked broadcasts: {e}")
+        return 0
+    resumed = 0
+    for broadcast_id in tracked:
+        raw = conn.hgetall(broadcast_key(broadcast_id))
+        fields = {name.decode(): value.decode() for name, value in raw.items()}
+        if not fields or fields['status'] in ('done', 'failed'):
+            conn.srem(BROADCASTS_KEY, broadcast_id)
+            continue
+        if time.time() - float(fields['updated_at']) < BROADCAST_STALL_SECONDS:
+            continue
+        ranges = json.loads(fields['ranges'])
+        sent = {int(batch) for batch in conn.smembers(_sent_key(broadcast_id))}
+        if len(sent) == len(ranges):
+            # The worker died between recording the last batch and marking the broadcast done
+            _finish_broadcast(conn, broadcast_id, 'done')
+            continue
+        pending = [
+            index for index in range(min(int(fields['queued']), len(ranges)))
+            if index + 1 not in sent
+        ]
+        logger.warning(f"[PushQueue] Resuming broadcast {broadcast_id}, requeueing {len(pending)} batches")
+        conn.hset(broadcast_key(broadcast_id), 'updated_at', time.time())
+        for index in pending:
+            queue.push(_broadcast_job(broadcast_id, fields, ranges, index))
+        # Ranges whose job died before queueing its successor are picked up here
+        for _ in range(BROADCAST_CONCURRENCY - len(pending)):
+            _queue_next_range(conn, broadcast_id, fields, ranges, queue)
+        resumed += 1
+    return resumed
+
+
+def process(job, queue):
+    if job.get('kind') == 'broadcast':
+        run_broadcast(job, queue)
+        return True
+    try:
+        if deliver(job):
+            return True
+    except Exception as e:
+        logger.error(f"[PushQueue] Push for user {job['user_id']} failed: {e}")
+    job['attempts'] += 1
+    if job['attempts'] >= MAX_ATTEMPTS:
+        logger.error(f"[PushQueue] Giving up on push for user {job['user_id']} after {job['attempts']} attempts")
+        return False
+    delay = BACKOFF_SECONDS * 2 ** (job['attempts'] - 1)
+    queue.schedule(job, delay)
+    logger.info(f"[PushQueue] Retrying push for user {job['user_id']} in {delay}s")
+    return False
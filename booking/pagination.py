@@ -0,0 +1,117 @@
+import base64
+import json
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(values):
+    """Opaque, URL-safe cursor for a list of JSON-serialisable sort key values"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+# Lists of bookings and pending requests are paged newest first on
+# (created_at, id): the id breaks ties between rows created in the same
+# microsecond, and rows inserted while a client pages land before its
+# cursor, so they never shift or repeat later pages.
+KEYSET_ORDERING = ('-created_at', '-id')
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _parse_time(value):
+    parsed = parse_datetime(value) if isinstance(value, str) else None
+    if parsed is None:
+        raise ValueError('Invalid datetime')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone=timezone.get_current_timezone())
+    return parsed
+
+
+def parse_page_params(params):
+    """
+    (limit, after, since) from the limit, cursor and since request
+    parameters. limit is None when the client asked for neither a limit
+    nor a cursor, i.e. wants the whole list; after is the (created_at, id)
+    of the last row already seen. Raises ValueError for bad values.
+    """
+    limit = params.get('limit')
+    cursor = params.get('cursor')
+    since = params.get('since')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError('Invalid limit')
+        limit = min(limit, MAX_PAGE_SIZE)
+    elif cursor:
+        limit = DEFAULT_PAGE_SIZE
+
+    after = None
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != 2:
+            raise ValueError('Invalid cursor')
+        after = (_parse_time(values[0]), str(values[1]))
+    return limit, after, _parse_time(since) if since else None
+
+
+def keyset_filter(after):
+    """
+    Rows that come after the (created_at, id) key in KEYSET_ORDERING. The
+    OR alone cannot bound an index scan, so the implied created_at__lte
+    is ANDed in for the planner to start the range from.
+    """
+    created_at, row_id = after
+    return Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=row_id))
+
+
+def keyset_key(row):
+    """Sort key matching KEYSET_ORDERING (with reverse=True) for rows held in memory"""
+    return row.created_at, str(row.id)
+
+
+def keyset_page(rows, limit):
+    """
+    Split up to limit + 1 rows in KEYSET_ORDERING into the page and the
+    cursor for the next one, or None when this is the last page
+    """
+    rows = list(rows)
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor([last.created_at.isoformat(), str(last.id)])
+
+
+def encode_sync_token(positions):
+    """Token for the changes feed: one (updated_at, id) position per table, id None once caught up"""
+    return encode_cursor([[moment.isoformat(), row_id] for moment, row_id in positions])
+
+
+def decode_sync_token(token, tables):
+    """Inverse of encode_sync_token for a feed over tables tables; raises ValueError"""
+    values = decode_cursor(token)
+    if len(values) != tables or not all(isinstance(v, list) and len(v) == 2 for v in values):
+        raise ValueError('Invalid token')
+    return [(_parse_time(moment), None if row_id is None else str(row_id)) for moment, row_id in values]
+
+
+def changed_after(position):
+    """Rows written after an (updated_at, id) position of the changes feed"""
+    moment, row_id = position
+    if row_id is None:
+        return Q(updated_at__gt=moment)
+    # Bounded like keyset_filter, so the scan starts at the position
+    return Q(updated_at__gte=moment) & (Q(updated_at__gt=moment) | Q(updated_at=moment, id__gt=row_id))
@@ -0,0 +1,356 @@
+import json
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import WatchError
+from .models import PendingRequests, PENDING_REQUEST_TTL
+from .pagination import KEYSET_ORDERING, keyset_filter, keyset_key
+
+logger = logging.getLogger(__name__)
+
+# In the Redis store a request is kept a while past its answer window so the
+# sweeper can still read it and record the expiry; the key TTL only cleans
+# up after a sweeper that is not running.
+REDIS_RETENTION = PENDING_REQUEST_TTL + timedelta(minutes=10)
+# Answered requests stay readable from Redis until flush() has written
+# them; the TTL only matters if flushing stops
+OUTCOME_RETENTION = timedelta(days=1)
+DUE_KEY = 'pending:due'
+OUTCOMES_KEY = 'pending:outcomes'
+
+
+class RequestResolved(Exception):
+    """
+    Raised inside a hold when the request was answered or expired by
+    someone else first, so the transaction and everything done for the
+    request in it is rolled back
+    """
+
+
+def _request_key(request_id):
+    return f'pending:request:{request_id}'
+
+
+def _outcome_key(request_id):
+    return f'pending:outcome:{request_id}'
+
+
+def _therapist_key(therapist_id):
+    return f'pending:therapist:{therapist_id}'
+
+
+def _customer_key(customer_id):
+    return f'pending:customer:{customer_id}'
+
+
+class _Encoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder rounds to milliseconds; slots are compared exactly
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _dump(pending):
+    return json.dumps(
+        {f.attname: getattr(pending, f.attname) for f in PendingRequests._meta.concrete_fields},
+        cls=_Encoder
+    )
+
+
+def _load(raw, live=True):
+    """A request from its stored form; live is False for answered ones waiting to be flushed"""
+    data = json.loads(raw)
+    pending = PendingRequests(**{
+        f.attname: f.to_python(data[f.attname])
+        for f in PendingRequests._meta.concrete_fields if f.attname in data
+    })
+    pending._in_redis = live
+    pending._queued = not live
+    return pending
+
+
+class DatabasePendingStore:
+    """Pending requests as PendingRequests rows, the default"""
+    in_database = True
+
+    def create(self, **fields):
+        return PendingRequests.objects.create(**fields)
+
+    def get(self, request_id):
+        return PendingRequests.objects.filter(id=request_id).first()
+
+    def set_status(self, pending, status):
+        """
+        Move pending from the status it was read with to status, unless
+        someone else changed it first. Returns whether this call did. In a
+        transaction the row stays locked until it ends, so the sweeper skips it.
+        """
+        updated = PendingRequests.objects.filter(id=pending.id, status=pending.status).update(
+            status=status, updated_at=timezone.now()
+        )
+        if updated:
+            pending.status = status
+        return bool(updated)
+
+    def live_for_therapists(self, therapist_ids):
+        return list(PendingRequests.objects.filter(
+            therapist_id__in=[str(t) for t in therapist_ids],
+            status='pending',
+            created_at__gt=timezone.now() - PENDING_REQUEST_TTL
+        ))
+
+    def for_user(self, role, user_id, status=None, since=None, after=None, limit=None):
+        """
+        A user's requests, newest first. since keeps those created after it;
+        after and limit select a keyset page, see booking.pagination.
+        """
+        if role == 'customer':
+            qs = PendingRequests.objects.filter(customer_id=str(user_id))
+        else:
+            qs = PendingRequests.objects.filter(therapist_id=str(user_id))
+        if status:
+            qs = qs.filter(status=status)
+        if since:
+            qs = qs.filter(created_at__gt=since)
+        if after:
+            qs = qs.filter(keyset_filter(after))
+        if limit is not None:
+            qs = qs.order_by(*KEYSET_ORDERING)[:limit]
+        return qs
+
+    def expire_due(self, batch_size, now=None):
+        cutoff = (now or timezone.now()) - PENDING_REQUEST_TTL
+        with transaction.atomic():
+            due = list(
+                PendingRequests.objects.select_for_update(skip_locked=True)
+                .filter(status='pending', created_at__lte=cutoff)
+                .order_by('created_at')
+                .values_list('id', 'customer_id', 'therapist_id')[:batch_size]
+            )
+            if due:
+                PendingRequests.objects.filter(id__in=[row[0] for row in due]).update(
+                    status='expired', updated_at=timezone.now()
+                )
+        return due
+
+    def next_expiry(self):
+        oldest = (
+            PendingRequests.objects.filter(status='pending')
+            .order_by('created_at')
+            .values_list('created_at', flat=True)
+            .first()
+        )
+        return oldest + PENDING_REQUEST_TTL if oldest is not None else None
+
+    def flush(self, batch_size):
+        return 0
+
+
+class RedisPendingStore:
+    """
+    In-flight requests live in Redis: one key per request with a TTL, plus
+    sorted sets by creation time per therapist, per customer and overall.
+    Only final outcomes reach Postgres, queued on a list and written in
+    batches by flush(). Until then an answered request is kept under an
+    outcome key, so reads keep seeing it; once flushed it is read from
+    Postgres.
+    """
+    in_database = False
+
+    def _conn(self):
+        return get_redis_connection('default')
+
+    def create(self, **fields):
+        pending = PendingRequests(**fields)
+        pending.created_at = timezone.now()
+        score = pending.created_at.timestamp()
+        request_id = str(pending.id)
+        pipe = self._conn().pipeline()
+        pipe.set(_request_key(request_id), _dump(pending), ex=int(REDIS_RETENTION.total_seconds()))
+        pipe.zadd(_therapist_key(pending.therapist_id), {request_id: score})
+        pipe.zadd(_customer_key(pending.customer_id), {request_id: score})
+        pipe.zadd(DUE_KEY, {request_id: score})
+        pipe.execute()
+        pending._in_redis = True
+        return pending
+
+    def get(self, request_id):
+        live, answered = self._conn().mget([_request_key(request_id), _outcome_key(request_id)])
+        if live is not None:
+            return _load(live)
+        if answered is not None:
+            return _load(answered, live=False)
+        return PendingRequests.objects.filter(id=request_id).first()
+
+    def _take(self, conn, request_id):
+        """Remove a live request and return its stored form, or None if it was already gone"""
+        pipe = conn.pipeline(transaction=True)
+        pipe.get(_request_key(request_id))
+        pipe.delete(_request_key(request_id))
+        raw, deleted = pipe.execute()
+        return raw if deleted else None
+
+    def _finish(self, conn, pending):
+        # The request stays in the therapist and customer sets until flushed,
+        # listed from its outcome key
+        request_id = str(pending.id)
+        pending.updated_at = timezone.now()
+        raw = _dump(pending)
+        pipe = conn.pipeline()
+        pipe.zrem(DUE_KEY, request_id)
+        pipe.set(_outcome_key(request_id), raw, ex=int(OUTCOME_RETENTION.total_seconds()))
+        pipe.rpush(OUTCOMES_KEY, raw)
+        pipe.execute()
+
+    def _replace_outcome(self, conn, pending, status):
+        """
+        Change an answered request that is not flushed yet, if it still has
+        the status it was read with. Returns None when it has been flushed
+        meanwhile, so the change has to go to Postgres instead.
+        """
+        key = _outcome_key(pending.id)
+        with conn.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                raw = pipe.get(key)
+                if raw is None:
+                    return None
+                current = _load(raw, live=False)
+                if current.status != pending.status:
+                    return False
+                current.status = status
+                current.updated_at = timezone.now()
+                raw = _dump(current)
+                pipe.multi()
+                pipe.set(key, raw, keepttl=True)
+                # Queued after the earlier outcome, so flush() writes this one last
+                pipe.rpush(OUTCOMES_KEY, raw)
+                pipe.execute()
+            except WatchError:
+                return False
+        pending.status = status
+        return True
+
+    def set_status(self, pending, status):
+        """Same contract as DatabasePendingStore.set_status"""
+        conn = self._conn()
+        if getattr(pending, '_queued', False):
+            replaced = self._replace_outcome(conn, pending, status)
+            if replaced is not None:
+                return replaced
+        if not getattr(pending, '_in_redis', False):
+            return DatabasePendingStore().set_status(pending, status)
+        if self._take(conn, pending.id) is None:
+            logger.info(f"[PendingStore] Request {pending.id} was resolved elsewhere before it became {status}")
+            return False
+        pending.status = status
+        self._finish(conn, pending)
+        return True
+
+    def _load_many(self, conn, request_ids, answered=False):
+        """Live requests among request_ids, and with answered=True the unflushed answered ones too"""
+        if not request_ids:
+            return []
+        raws = conn.mget([_request_key(r) for r in request_ids])
+        rows = [_load(raw) for raw in raws if raw is not None]
+        if answered:
+            raws = conn.mget([_outcome_key(r) for r in request_ids])
+            rows += [_load(raw, live=False) for raw in raws if raw is not None]
+        return rows
+
+    def live_for_therapists(self, therapist_ids):
+        conn = self._conn()
+        since = (timezone.now() - PENDING_REQUEST_TTL).timestamp()
+        pipe = conn.pipeline()
+        for therapist_id in therapist_ids:
+            pipe.zrangebyscore(_therapist_key(therapist_id), f'({since}', '+inf')
+        request_ids = [r.decode() for ids in pipe.execute() for r in ids]
+        return [p for p in self._load_many(conn, request_ids) if p.status == 'pending']
+
+    def for_user(self, role, user_id, status=None, since=None, after=None, limit=None):
+        conn = self._conn()
+        key = _customer_key(user_id) if role == 'customer' else _therapist_key(user_id)
+        in_redis = {
+            p.id: p for p in self._load_many(conn, [r.decode() for r in conn.zrange(key, 0, -1)], answered=True)
+            if (not status or p.status == status)
+            and (not since or p.created_at > since)
+            and (not after or keyset_key(p) < after)
+        }
+        # A request being flushed can briefly be in both; Redis has it as fresh
+        history = [
+            p for p in DatabasePendingStore().for_user(role, user_id, status, since, after, limit)
+            if p.id not in in_redis
+        ]
+        rows = sorted(list(in_redis.values()) + history, key=keyset_key, reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+    def expire_due(self, batch_size, now=None):
+        cutoff = ((now or timezone.now()) - PENDING_REQUEST_TTL).timestamp()
+        conn = self._conn()
+        due = []
+        for request_id in conn.zrangebyscore(DUE_KEY, '-inf', cutoff, start=0, num=batch_size):
+            raw = self._take(conn, request_id.decode())
+            if raw is None:
+                # Answered or expired by someone else in the meantime
+                conn.zrem(DUE_KEY, request_id)
+                continue
+            pending = _load(raw)
+            pending.status = 'expired'
+            self._finish(conn, pending)
+            due.append((pending.id, pending.customer_id, pending.therapist_id))
+        return due
+
+    def next_expiry(self):
+        oldest = self._conn().zrange(DUE_KEY, 0, 0, withscores=True)
+        if not oldest:
+            return None
+        return datetime.fromtimestamp(oldest[0][1], tz=dt_timezone.utc) + PENDING_REQUEST_TTL
+
+    def flush(self, batch_size):
+        """Write up to batch_size queued outcomes to Postgres, returning how many were written"""
+        conn = self._conn()
+        pipe = conn.pipeline(transaction=True)
+        pipe.lrange(OUTCOMES_KEY, 0, batch_size - 1)
+        pipe.ltrim(OUTCOMES_KEY, batch_size, -1)
+        raws, _ = pipe.execute()
+        if not raws:
+            return 0
+        # A request answered and then changed again is queued twice; the
+        # later outcome wins
+        rows = list({row.id: row for row in (_load(raw, live=False) for raw in raws)}.values())
+        created = [row.created_at for row in rows]
+        try:
+            with transaction.atomic():
+                PendingRequests.objects.bulk_create(
+                    rows, update_conflicts=True, unique_fields=['id'], update_fields=['status', 'updated_at']
+                )
+                # created_at is auto_now_add, which bulk_create overwrites
+                for row, created_at in zip(rows, created):
+                    row.created_at = created_at
+                PendingRequests.objects.bulk_update(rows, ['created_at'])
+        except Exception:
+            # Put the batch back so the next flush retries it
+            conn.lpush(OUTCOMES_KEY, *reversed(raws))
+            raise
+        pipe = conn.pipeline()
+        for row in rows:
+            pipe.delete(_outcome_key(row.id))
+            pipe.zrem(_therapist_key(row.therapist_id), str(row.id))
+            pipe.zrem(_customer_key(row.customer_id), str(row.id))
+        pipe.execute()
+        return len(raws)
+
+
+_stores = {
+    'database': DatabasePendingStore(),
+    'redis': RedisPendingStore(),
+}
+
+
+def get_pending_store():
+    return _stores[settings.PENDING_STORE_BACKEND]
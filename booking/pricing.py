@@ -0,0 +1,133 @@
+import logging
+import re
+from decimal import Decimal, InvalidOperation
+from django.core.cache import cache
+from therapist.models import Services as TherapistServices
+
+logger = logging.getLogger(__name__)
+
+PRICES_TTL_SECONDS = 60 * 60
+ZERO = Decimal('0.00')
+
+
+def normalize_service(name):
+    """Fold "4 Hands Oil", "4_hands_oil" and "4-hands-oil" to the same key"""
+    return re.sub(r'[\s_\-]+', ' ', str(name)).strip().lower()
+
+
+# Every spelling of a known service, by code or label, maps to its code
+SERVICE_KEYS = {}
+for _code, _label in TherapistServices.SERVICE_CHOICES:
+    SERVICE_KEYS[normalize_service(_code)] = _code
+    SERVICE_KEYS[normalize_service(_label)] = _code
+
+
+def service_key(name):
+    normalized = normalize_service(name)
+    return SERVICE_KEYS.get(normalized, normalized)
+
+
+def _prices_key(therapist_id):
+    return f'therapist-prices:{therapist_id}'
+
+
+def _to_decimal(value):
+    try:
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return ZERO
+
+
+def price_maps(therapist_ids):
+    """
+    {therapist id: price map} for every id given, as strings, reading the
+    cache in one round trip and the database in one query for the misses.
+    Therapists without services map to an empty dict.
+    """
+    ids = {str(t) for t in therapist_ids}
+    keys = {_prices_key(t): t for t in ids}
+    cache_ok = True
+    try:
+        cached = cache.get_many(list(keys))
+    except Exception as e:
+        logger.warning(f"[Pricing] Cache unavailable: {e}")
+        cached, cache_ok = {}, False
+    maps = {keys[key]: prices for key, prices in cached.items()}
+
+    missing = [t for t in ids if t not in maps]
+    if not missing:
+        return maps
+    services = dict(
+        TherapistServices.objects.filter(user_id__in=[t for t in missing if t.isdigit()])
+        .values_list('user_id', 'services')
+    )
+    loaded = {
+        t: {service_key(name): _to_decimal(price) for name, price in (services.get(int(t)) or {}).items()}
+        if t.isdigit() else {}
+        for t in missing
+    }
+    if cache_ok:
+        try:
+            cache.set_many({_prices_key(t): prices for t, prices in loaded.items()}, timeout=PRICES_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"[Pricing] Could not cache prices: {e}")
+    maps.update(loaded)
+    return maps
+
+
+def price_map(therapist_id):
+    """A therapist's {service key: price}, cached until their services change"""
+    return price_maps([therapist_id])[str(therapist_id)]
+
+
+def invalidate(therapist_id):
+    try:
+        cache.delete(_prices_key(therapist_id))
+    except Exception as e:
+        logger.warning(f"[Pricing] Could not invalidate prices for therapist {therapist_id}: {e}")
+
+
+class Quote:
+    """Priced lines for a request; unknown services are priced at zero"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.total = sum((line['total_price'] for line in lines), ZERO)
+
+    def as_list(self):
+        """Lines with float amounts, as the API has always returned them"""
+        return [
+            {**line, 'price_per_unit': float(line['price_per_unit']), 'total_price': float(line['total_price'])}
+            for line in self.lines
+        ]
+
+
+def _quantity(value):
+    # A missing or zero quantity still means the customer wants the service once
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return 1
+    return quantity if quantity > 0 else 1
+
+
+def quote(therapist_id, services, prices=None):
+    """
+    Price the requested services, a {name: quantity} dict, with the
+    therapist's rates. prices can be passed when the caller already has the
+    therapist's price map.
+    """
+    prices = price_map(therapist_id) if prices is None else prices
+    if not prices:
+        return Quote([])
+    lines = []
+    for name, quantity in (services or {}).items():
+        quantity = _quantity(quantity)
+        unit_price = prices.get(service_key(name), ZERO)
+        lines.append({
+            'service_name': name,
+            'quantity': quantity,
+            'price_per_unit': unit_price,
+            'total_price': unit_price * quantity,
+        })
+    return Quote(lines)
@@ -1,6 +1,18 @@
+from django.db.models import QuerySet
 from rest_framework import serializers
 from .models import Booking, FCMToken, PendingRequests, Coupon
-from therapist.models import Services as TherapistAddress
+from api.models import Pictures
+from therapist.models import TherapistAddress
+from . import pricing
+
+class PendingRequestsListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # customer_id and therapist_id are not foreign keys, so instead of
+        # prefetching, look up what every row needs once for the whole list
+        rows = list(data)
+        self.child.preload(rows)
+        return super().to_representation(rows)
+
 
 class PendingRequestsSerializer(serializers.ModelSerializer):
     services_with_pricing = serializers.SerializerMethodField()
@@ -8,83 +20,57 @@ class PendingRequestsSerializer(serializers.ModelSerializer):
     customer_profile_picture = serializers.SerializerMethodField()
     therapist_profile_picture = serializers.SerializerMethodField()
 
+    # Filled by preload() when serializing a list
+    _pictures = None
+    _prices = None
+
     class Meta:
         model = PendingRequests
-        fields = [ 'id', 'customer_id', 'therapist_id', 'status', 'customer_name', 'services', 'services_with_pricing', 'total_amount', 'timeslot_from', 'timeslot_to', 'latitude', 'longitude', 'distance', 'customer_profile_picture', 'therapist_profile_picture', 'created_at']
-        read_only_fields = ['id', 'created_at', 'services_with_pricing', 'total_amount', 'customer_profile_picture', 'therapist_profile_picture']
+        list_serializer_class = PendingRequestsListSerializer
+        fields = [ 'id', 'customer_id', 'therapist_id', 'status', 'customer_name', 'services', 'services_with_pricing', 'total_amount', 'timeslot_from', 'timeslot_to', 'latitude', 'longitude', 'distance', 'customer_profile_picture', 'therapist_profile_picture', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'services_with_pricing', 'total_amount', 'customer_profile_picture', 'therapist_profile_picture']
+
+    def preload(self, rows):
+        """Profile pictures of every user and price maps of every therapist in rows"""
+        user_ids = {r.customer_id for r in rows} | {r.therapist_id for r in rows}
+        self._pictures = {
+            str(user_id): picture
+            for user_id, picture in Pictures.objects.filter(
+                user_id__in=[u for u in user_ids if str(u).isdigit()]
+            ).values_list('user_id', 'profile_picture')
+        }
+        self._prices = pricing.price_maps({r.therapist_id for r in rows})
+
+    def _quote(self, obj):
+        # Both pricing fields come from one quote per request
+        cached = getattr(obj, '_quote', None)
+        if cached is None:
+            prices = self._prices.get(str(obj.therapist_id)) if self._prices is not None else None
+            try:
+                cached = pricing.quote(obj.therapist_id, obj.services, prices=prices)
+            except Exception:
+                cached = pricing.Quote([])
+            obj._quote = cached
+        return cached
 
     def get_services_with_pricing(self, obj):
-        try:
-            import ast
-            from therapist.models import Services as TherapistServices
-            from django.contrib.auth import get_user_model
-
-            User = get_user_model()
-            therapist = User.objects.get(id=obj.therapist_id)
-            therapist_services = TherapistServices.objects.filter(user=therapist).first()
-
-            # Parse services string to dict
-            if isinstance(obj.services, str):
-                try:
-                    requested_services = ast.literal_eval(obj.services)
-                except:
-                    requested_services = {}
-            else:
-                requested_services = obj.services or {}
-
-            services_array = []
-            if therapist_services and therapist_services.services:
-                for service_name, quantity in requested_services.items():
-                    # Try to find price by exact match first
-                    price_per_service = therapist_services.services.get(service_name, 0)
-
-                    # If not found, try alternative formats
-                    if price_per_service == 0:
-                        # Convert spaces to underscores: "4 hands oil" -> "4_hands_oil"
-                        alt_name = service_name.replace(' ', '_')
-                        price_per_service = therapist_services.services.get(alt_name, 0)
-
-                        # Try other common variations
-                        if price_per_service == 0:
-                            alt_name = service_name.replace('_', ' ')
-                            price_per_service = therapist_services.services.get(alt_name, 0)
-
-                    # Set default quantity to 1 if it's 0 (assuming they want the service)
-                    actual_quantity = int(quantity) if quantity and int(quantity) > 0 else 1
-
-                    services_array.append({
-                        'service_name': service_name,
-                        'quantity': actual_quantity,
-                        'price_per_unit': float(price_per_service),
-                        'total_price': float(price_per_service) * actual_quantity
-                    })
-
-            return services_array
-        except Exception as e:
-            return []
+        return self._quote(obj).as_list()
 
     def get_total_amount(self, obj):
-        services_pricing = self.get_services_with_pricing(obj)
-        total = sum(service['total_price'] for service in services_pricing)
-        return float(total)
+        return float(self._quote(obj).total)
 
-    def get_customer_profile_picture(self, obj):
-        try:
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            customer = User.objects.get(id=obj.customer_id)
-            return customer.therapist_pictures.profile_picture
-        except:
+    def _picture(self, user_id):
+        if self._pictures is not None:
+            return self._pictures.get(str(user_id))
+        if not str(user_id).isdigit():
             return None
+        return Pictures.objects.filter(user_id=user_id).values_list('profile_picture', flat=True).first()
+
+    def get_customer_profile_picture(self, obj):
+        return self._picture(obj.customer_id)
 
     def get_therapist_profile_picture(self, obj):
-        try:
-            from django.contrib.auth import get_user_model
-            User = get_user_model()
-            therapist = User.objects.get(id=obj.therapist_id)
-            return therapist.therapist_pictures.profile_picture
-        except:
-            return None
+        return self._picture(obj.therapist_id)
 
 class FCMTokenSerializer(serializers.ModelSerializer):
     class Meta:
@@ -105,6 +91,25 @@ class BookingResponseSerializer(serializers.Serializer):
     id = serializers.UUIDField()
     action = serializers.ChoiceField(choices=['accept', 'reject'])
 
+# Every relation BookingSerializer reads; all are forward or one-to-one, so a
+# single joined query loads them
+BOOKING_RELATED = (
+    'customer',
+    'customer__therapist_pictures',
+    'therapist',
+    'therapist__therapist_address',
+    'therapist__therapist_pictures',
+    'coupon',
+)
+
+
+class BookingListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        if isinstance(data, QuerySet):
+            data = BookingSerializer.eager(data)
+        return super().to_representation(data)
+
+
 class BookingSerializer(serializers.ModelSerializer):
     source = serializers.SerializerMethodField()
     destination = serializers.SerializerMethodField()
@@ -122,19 +127,26 @@ class BookingSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Booking
+        # Querysets serialized with many=True get BOOKING_RELATED joined in
+        list_serializer_class = BookingListSerializer
         fields = [
             'id', 'customer_id', 'therapist_id', 'time_slot_from', 'time_slot_to', 'services',
             'subtotal', 'coupon_discount', 'total', 'status',
             'cancellation_reason', 'distance',
-            'created_at', 'started_at', 'completed_at', 'cancelled_at',
+            'created_at', 'updated_at', 'started_at', 'completed_at', 'cancelled_at',
             'customer_name', 'therapist_name', 'customer_phone', 'therapist_phone',
             'customer_email', 'therapist_email', 'customer_profile_picture', 'therapist_profile_picture',
             'coupon_info', 'source', 'destination'
         ]
-        read_only_fields = ['id', 'created_at', 'source', 'destination', 'customer_name', 'therapist_name',
+        read_only_fields = ['id', 'created_at', 'updated_at', 'source', 'destination', 'customer_name', 'therapist_name',
                            'customer_id', 'therapist_id', 'customer_phone', 'therapist_phone',
                            'customer_email', 'therapist_email', 'customer_profile_picture', 'therapist_profile_picture']
 
+    @staticmethod
+    def eager(queryset):
+        """queryset with everything the serializer reads loaded in the same query"""
+        return queryset.select_related(*BOOKING_RELATED)
+
     def get_source(self, obj):
         try:
             ta = obj.therapist.therapist_address
@@ -0,0 +1,195 @@
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import accumulate
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import CharField, F, Value
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import Booking, PendingRequests, PENDING_REQUEST_TTL
+from .pending_store import get_pending_store
+
+User = get_user_model()
+
+# Booking statuses that occupy the therapist's time slot
+BLOCKING_BOOKING_STATUSES = ['active', 'started']
+
+
+class IntervalIndex:
+    """
+    Busy intervals grouped per therapist. Each therapist's intervals are kept
+    sorted by start with a running maximum of their ends, so "does anything
+    overlap [start, end)" is a single bisect.
+    """
+
+    def __init__(self):
+        self._pending = defaultdict(list)
+        self._starts = {}
+        self._max_ends = {}
+
+    def add(self, key, start, end):
+        self._pending[key].append((start, end))
+        self._starts.pop(key, None)
+
+    def _build(self, key):
+        intervals = sorted(self._pending.get(key, []))
+        self._starts[key] = [s for s, _ in intervals]
+        self._max_ends[key] = list(accumulate((e for _, e in intervals), max))
+
+    def overlaps(self, key, start, end):
+        if key not in self._starts:
+            self._build(key)
+        # Intervals starting before `end` are the only candidates; the
+        # furthest-reaching one among them decides the answer.
+        count = bisect_left(self._starts[key], end)
+        return count > 0 and self._max_ends[key][count - 1] > start
+
+
+def load_interval_index(therapist_ids, start, end):
+    """
+    Index the active bookings and live pending requests of the given
+    therapists that overlap [start, end), in two queries (or one query and
+    one Redis round trip with the Redis pending store).
+    """
+    index = IntervalIndex()
+    therapist_ids = list(therapist_ids)
+    if not therapist_ids:
+        return index
+
+    bookings = Booking.objects.filter(
+        therapist_id__in=therapist_ids,
+        status__in=BLOCKING_BOOKING_STATUSES,
+        time_slot_from__lt=end,
+        time_slot_to__gt=start
+    ).values_list('therapist_id', 'time_slot_from', 'time_slot_to')
+    for therapist_id, slot_from, slot_to in bookings:
+        index.add(int(therapist_id), slot_from, slot_to)
+
+    store = get_pending_store()
+    if store.in_database:
+        pending = PendingRequests.objects.filter(
+            therapist_id__in=[str(t) for t in therapist_ids],
+            status='pending',
+            created_at__gt=timezone.now() - PENDING_REQUEST_TTL,
+            timeslot_from__lt=end,
+            timeslot_to__gt=start
+        ).values_list('therapist_id', 'timeslot_from', 'timeslot_to')
+    else:
+        pending = [
+            (p.therapist_id, p.timeslot_from, p.timeslot_to)
+            for p in store.live_for_therapists(therapist_ids)
+        ]
+    for therapist_id, slot_from, slot_to in pending:
+        index.add(int(therapist_id), slot_from, slot_to)
+
+    return index
+
+
+def busy_therapists(therapist_ids, start, end):
+    """Return the subset of therapist_ids that are booked or held during [start, end)"""
+    therapist_ids = list(therapist_ids)
+    index = load_interval_index(therapist_ids, start, end)
+    return {t for t in therapist_ids if index.overlaps(int(t), start, end)}
+
+
+class SlotCheck:
+    """Outcome of check_and_hold; views map each outcome to a response"""
+    FREE = 'free'
+    # The same customer already has a live request with identical details
+    DUPLICATE = 'duplicate'
+    # The therapist has an active or started booking overlapping the slot
+    BOOKED = 'booked'
+    # The same customer has a live request overlapping the slot
+    OWN_PENDING = 'own_pending'
+    # Another customer has a live request overlapping the slot
+    HELD = 'held'
+
+    def __init__(self, outcome, conflict_id=None, hold=None):
+        self.outcome = outcome
+        self.conflict_id = conflict_id
+        self.hold = hold
+
+    @property
+    def ok(self):
+        return self.outcome == self.FREE
+
+    def __repr__(self):
+        return f"SlotCheck({self.outcome!r}, conflict_id={self.conflict_id!r})"
+
+
+def _overlapping_rows(therapist_id, timeslot_from, timeslot_to, include_pending):
+    bookings = Booking.objects.filter(
+        therapist_id=therapist_id,
+        status__in=BLOCKING_BOOKING_STATUSES,
+        time_slot_from__lt=timeslot_to,
+        time_slot_to__gt=timeslot_from
+    ).order_by().annotate(
+        kind=Value('booking', output_field=CharField()),
+        owner=Cast('customer_id', output_field=CharField(max_length=36)),
+        hash=Value(None, output_field=CharField(max_length=64))
+    ).values_list('id', 'kind', 'owner', 'time_slot_from', 'time_slot_to', 'hash')
+    if not include_pending:
+        return list(bookings)
+
+    store = get_pending_store()
+    if not store.in_database:
+        return list(bookings) + [
+            (p.id, 'pending', p.customer_id, p.timeslot_from, p.timeslot_to, p.request_hash)
+            for p in store.live_for_therapists([therapist_id])
+            if p.timeslot_from < timeslot_to and p.timeslot_to > timeslot_from
+        ]
+
+    pending = PendingRequests.objects.filter(
+        therapist_id=str(therapist_id),
+        status='pending',
+        created_at__gt=timezone.now() - PENDING_REQUEST_TTL,
+        timeslot_from__lt=timeslot_to,
+        timeslot_to__gt=timeslot_from
+    ).order_by().annotate(
+        kind=Value('pending', output_field=CharField()),
+        owner=F('customer_id'),
+        hash=F('request_hash')
+    ).values_list('id', 'kind', 'owner', 'timeslot_from', 'timeslot_to', 'hash')
+    return list(bookings.union(pending, all=True))
+
+
+def check_and_hold(therapist, timeslot_from, timeslot_to, customer_id=None, include_pending=True, hold=None,
+                   request_hash=None):
+    """
+    Decide whether therapist can take [timeslot_from, timeslot_to) for
+    customer_id, and if so call hold() to reserve it (create the pending
+    request or the booking). Every conflict question is answered from one
+    query over overlapping bookings and live pending requests.
+    include_pending=False only considers bookings, which is what accepting
+    an already-pending request needs. request_hash is the new request's
+    PendingRequests.hash_request(); a live request with the same hash is
+    reported as a DUPLICATE.
+
+    The check and the hold run in one transaction holding a row lock on the
+    therapist, so concurrent requests for the same therapist are serialised
+    and two overlapping holds can never both be granted.
+    """
+    with transaction.atomic():
+        User.objects.select_for_update().filter(id=therapist.id).values_list('id', flat=True).first()
+        return _check(therapist, timeslot_from, timeslot_to, customer_id, include_pending, hold, request_hash)
+
+
+def _check(therapist, timeslot_from, timeslot_to, customer_id, include_pending, hold, request_hash):
+    rows = _overlapping_rows(therapist.id, timeslot_from, timeslot_to, include_pending)
+    customer_id = str(customer_id) if customer_id is not None else None
+
+    own = [r for r in rows if r[1] == 'pending' and r[2] == customer_id]
+    if request_hash is not None:
+        for row_id, _, _, _, _, row_hash in own:
+            if row_hash == request_hash:
+                return SlotCheck(SlotCheck.DUPLICATE, conflict_id=row_id)
+    for row_id, kind, _, _, _, _ in rows:
+        if kind == 'booking':
+            return SlotCheck(SlotCheck.BOOKED, conflict_id=row_id)
+    if own:
+        return SlotCheck(SlotCheck.OWN_PENDING, conflict_id=own[0][0])
+    for row_id, kind, _, _, _, _ in rows:
+        if kind == 'pending':
+            return SlotCheck(SlotCheck.HELD, conflict_id=row_id)
+
+    return SlotCheck(SlotCheck.FREE, hold=hold() if hold is not None else None)
@@ -12,6 +12,7 @@ urlpatterns = [
     path('bookings/<uuid:booking_id>/', views.booking_detail_view, name='booking_detail'),
     path('bookings/<uuid:booking_id>/update-status/', views.update_booking_status, name='update_booking_status'),
     path('pending-requests/', views.pending_requests_list, name='pending_requests_list'),
+    path('changes/', views.booking_changes, name='booking_changes'),
     path('analytics/', views.therapist_analytics, name='therapist_analytics'),
     path('validate-coupon/', views.validate_coupon, name='validate_coupon'),
     path('apply-coupon/', views.apply_coupon, name='apply_coupon'),
@@ -1,4 +1,3 @@
-import math
 from django.contrib.auth import get_user_model
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
@@ -6,16 +5,61 @@ from rest_framework import status
 from User.permissions import IsCustomer, IsTherapist
 from rest_framework.permissions import IsAuthenticated
 from therapist.models import Services as TherapistServices, TherapistAddress, TherapistStatus
+from therapist.snapshot import get_snapshot
+from therapist import search_cache
 from .models import Booking, FCMToken, PendingRequests, Coupon
 from .serializers import FCMTokenSerializer, BookingRequestSerializer, BookingResponseSerializer, BookingSerializer, PendingRequestsSerializer, CouponValidationSerializer, ApplyCouponSerializer
-from .firebase_utils import send_push_notification
+from . import analytics
+from .events import publish_booking_event
+from .idempotency import idempotent
+from .notifications import enqueue_push
+from .pagination import (
+    KEYSET_ORDERING, changed_after, decode_cursor, decode_sync_token, encode_cursor, encode_sync_token,
+    keyset_filter, keyset_page, parse_page_params
+)
+from .pending_store import RequestResolved, get_pending_store
+from . import pricing
+from .slots import SlotCheck, busy_therapists, check_and_hold
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal
+from django.db.models import Q
 from django.utils import timezone
 from django.utils.dateparse import parse_datetime
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 
 User = get_user_model()
 
+NEAREST_DEFAULT_K = 20
+NEAREST_MAX_K = 100
+
+CHANGES_PAGE_SIZE = 500
+CHANGES_OVERLAP = timedelta(seconds=5)
+SYNC_START = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+def already_responded():
+    return Response({
+        'error': 'Request not found or already responded',
+        'message': 'You have already responded to this booking request.'
+    }, status=status.HTTP_409_CONFLICT)
+
+def request_expired():
+    return Response({
+        'error': 'Request has expired',
+        'message': 'This booking request expired because it was not accepted within 2 minutes.'
+    }, status=status.HTTP_410_GONE)
+
+def search_result(payload, distance):
+    return {
+        'id': payload['id'],
+        'name': payload['name'],
+        'email': payload['email'],
+        'profile_picture': payload['profile_picture'],
+        'address': payload['address'],
+        'distance': round(distance, 2),
+        'services': payload['services'],
+    }
+
 @api_view(['GET'])
 @permission_classes([IsCustomer])
 def search_therapists_view(request):
@@ -38,67 +82,129 @@ def search_therapists_view(request):
     if services_param:
         service_list = [s.strip() for s in services_param.split(',') if s.strip()]
     
-    def haversine(lat1, lon1, lat2, lon2):
-        R = 6371 
-        phi1 = math.radians(lat1)
-        phi2 = math.radians(lat2)
-        dphi = math.radians(lat2 - lat1)
-        dlambda = math.radians(lon2 - lon1)
-        a = math.sin(dphi/2)**2 + math.cos(phi1)*math.cos(phi2)*math.sin(dlambda/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c
-    
-    addresses = TherapistAddress.objects.filter(
-        user__therapist_status__status='available'
-    )
-    results = []
-    
-    for addr in addresses:
-        if addr.latitude is None or addr.longitude is None:
-            continue
-        
-        distance = haversine(user_lat, user_lon, float(addr.latitude), float(addr.longitude))
-        
-        if distance <= search_radius:
-            therapist = addr.user
-            status_obj = TherapistStatus.objects.filter(user=therapist).first()
-            if not status_obj or status_obj.status != 'available':
+    # services_match=all asks for therapists offering every listed service
+    match_all = request.query_params.get('services_match') == 'all'
+    service_mask = TherapistServices.mask_for(service_list)
+    unmatchable = bool(service_list) and not service_mask
+    if match_all and service_list and not all(TherapistServices.mask_for([s]) for s in service_list):
+        unmatchable = True
+
+    # Optional time slot: therapists already booked or holding a live
+    # request during it are left out
+    slot_from_raw = request.query_params.get('timeslot_from')
+    slot_to_raw = request.query_params.get('timeslot_to')
+    slot = None
+    if slot_from_raw or slot_to_raw:
+        slot_from = parse_datetime(slot_from_raw or '')
+        slot_to = parse_datetime(slot_to_raw or '')
+        if slot_from is None or slot_to is None or slot_from >= slot_to:
+            return Response({'error': 'Invalid timeslot_from or timeslot_to'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(slot_from):
+            slot_from = timezone.make_aware(slot_from, timezone=timezone.get_current_timezone())
+        if timezone.is_naive(slot_to):
+            slot_to = timezone.make_aware(slot_to, timezone=timezone.get_current_timezone())
+        slot = (slot_from, slot_to)
+
+    # Served from this worker's in-memory snapshot of available therapists
+    snapshot = get_snapshot()
+    radius_cap = search_radius if 'radius' in request.query_params else None
+
+    # The therapists who could match anywhere in the customer's neighbourhood
+    # are shared for a few seconds; distances and the final filtering always
+    # use the customer's own coordinates. Searches for a time slot depend on
+    # bookings as well and are never cached.
+    nearest_mode = request.query_params.get('mode') == 'nearest'
+    entry = None
+    version = None
+    if slot is None and not unmatchable:
+        cell_lat, cell_lon = search_cache.quantize(user_lat, user_lon)
+        key = search_cache.cache_key(
+            cell_lat, cell_lon, search_radius, service_list,
+            match_all=match_all,
+            mode=request.query_params.get('mode', ''),
+            radius_given=radius_cap is not None
+        )
+        entry, version = search_cache.lookup(key)
+        cache_status = 'HIT' if entry is not None else 'MISS'
+        if entry is None and version is not None:
+            bound = None
+            if nearest_mode:
+                # Only the therapists closest to the cell's centre are kept;
+                # searches that page past them fall back to the snapshot
+                matches = snapshot.nearest_covering(
+                    cell_lat, cell_lon, search_cache.MAX_CANDIDATES + 1, radius_km=radius_cap,
+                    service_mask=service_mask, match_all=match_all, slack_km=search_cache.SLACK_KM
+                )
+                if len(matches) > search_cache.MAX_CANDIDATES:
+                    bound = matches.pop()[1]
+            else:
+                matches = snapshot.nearest(
+                    cell_lat, cell_lon, search_radius + search_cache.SLACK_KM, service_mask, match_all
+                )
+            entry = {'ids': [payload['id'] for payload, _ in matches], 'bound': bound}
+            search_cache.store(key, version, entry['ids'], bound)
+    candidates = entry['ids'] if entry is not None else None
+
+    if nearest_mode:
+        # k nearest therapists whose own service radius covers the customer,
+        # paginated with an opaque (distance, id) cursor
+        try:
+            k = min(int(request.query_params.get('k', NEAREST_DEFAULT_K)), NEAREST_MAX_K)
+            cursor = request.query_params.get('cursor')
+            after = None
+            if cursor:
+                last_distance, last_id = decode_cursor(cursor)
+                after = (float(last_distance), int(last_id))
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid k or cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        if k < 1:
+            return Response({'error': 'Invalid k or cursor'}, status=status.HTTP_400_BAD_REQUEST)
+        if unmatchable:
+            return Response({'results': [], 'next_cursor': None}, status=status.HTTP_200_OK)
+
+        busy = set()
+        checked = set()
+        while True:
+            matches = snapshot.nearest_covering(
+                user_lat, user_lon, k + 1, radius_km=radius_cap, service_mask=service_mask,
+                match_all=match_all, after=after, exclude=busy, only=candidates
+            )
+            if candidates is not None and not search_cache.covers(entry, matches, k + 1):
+                candidates = None
                 continue
-            
-            serv_obj = TherapistServices.objects.filter(user=therapist).first()
-            
-            if service_list and serv_obj:
-                therapist_services = serv_obj.services or {}
-                has_matching_service = any(service in therapist_services for service in service_list)
-                if not has_matching_service:
-                    continue
-            
-            # Get profile picture
-            profile_picture = None
-            try:
-                profile_picture = therapist.therapist_pictures.profile_picture
-            except:
-                pass
-
-            data = {
-                'id': therapist.id,
-                'name': therapist.name,
-                'email': therapist.email,
-                'profile_picture': profile_picture,
-                'address': {
-                    'address':addr.address,
-                    'coordinates':{
-                        'latitude': addr.latitude,
-                        'longitude': addr.longitude
-                    }
-                },
-                'distance': round(distance, 2),
-                'services': serv_obj.services if serv_obj else {},
-            }
-            results.append(data)
-    
-    results.sort(key=lambda x: x['distance'])
-    return Response(results, status=status.HTTP_200_OK)
+            if slot is None:
+                break
+            # Busy therapists are dropped and the page refilled from the
+            # next nearest ones, checking each therapist only once
+            unchecked = [p['id'] for p, _ in matches if p['id'] not in checked]
+            checked.update(unchecked)
+            newly_busy = busy_therapists(unchecked, *slot)
+            if not newly_busy:
+                break
+            busy |= newly_busy
+        page = matches[:k]
+        next_cursor = None
+        if len(matches) > k:
+            last_payload, last_distance = page[-1]
+            next_cursor = encode_cursor([last_distance, last_payload['id']])
+        data = {
+            'results': [search_result(payload, distance) for payload, distance in page],
+            'next_cursor': next_cursor
+        }
+    else:
+        if unmatchable:
+            return Response([], status=status.HTTP_200_OK)
+
+        matches = snapshot.nearest(user_lat, user_lon, search_radius, service_mask, match_all, only=candidates)
+        if slot is not None:
+            busy = busy_therapists([p['id'] for p, _ in matches], *slot)
+            matches = [(p, d) for p, d in matches if p['id'] not in busy]
+
+        data = [search_result(payload, distance) for payload, distance in matches]
+
+    if version is None:
+        return Response(data, status=status.HTTP_200_OK)
+    return Response(data, status=status.HTTP_200_OK, headers={'X-Search-Cache': cache_status})
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -117,6 +223,7 @@ def register_fcm_token(request):
 
 @api_view(['POST'])
 @permission_classes([IsCustomer])
+@idempotent
 def send_booking_request(request):
     serializer = BookingRequestSerializer(data=request.data)
     if not serializer.is_valid():
@@ -131,45 +238,49 @@ def send_booking_request(request):
     
     customer_id = str(request.user.id)
     therapist_id = str(therapist.id)
-    services = str(data['services'])
+    services = data['services']
     coupon_code = data.get('coupon_code', '').strip() or None
     timeslot_from = data['timeslot_from']
     timeslot_to = data['timeslot_to']
     latitude = data['latitude']
     longitude = data['longitude']
     distance = data['distance']
+    request_hash = PendingRequests.hash_request(
+        customer_id, therapist_id, services, timeslot_from, timeslot_to, latitude, longitude, distance
+    )
+
+    def create_pending_request():
+        return get_pending_store().create(
+            customer_id=customer_id,
+            therapist_id=therapist_id,
+            status='pending',
+            customer_name=getattr(request.user, 'name', None) or str(request.user),
+            services=services,
+            coupon_code=coupon_code,
+            timeslot_from=timeslot_from,
+            timeslot_to=timeslot_to,
+            latitude=latitude,
+            longitude=longitude,
+            distance=distance,
+            request_hash=request_hash
+        )
+
+    check = check_and_hold(
+        therapist, timeslot_from, timeslot_to, customer_id=customer_id, hold=create_pending_request,
+        request_hash=request_hash
+    )
 
-    already = PendingRequests.objects.filter(
-        customer_id=customer_id,
-        therapist_id=therapist_id,
-        services=services,
-        timeslot_from=timeslot_from,
-        timeslot_to=timeslot_to,
-        latitude=latitude,
-        longitude=longitude,
-        distance=distance,
-        status='pending',
-    ).first()
-
-    if already:
+    if check.outcome == SlotCheck.DUPLICATE:
         return Response(
             {
                 'status': 'already_exists',
-                'pending_booking_id': str(already.id),
+                'pending_booking_id': str(check.conflict_id),
                 'message': 'A pending booking request with these exact details already exists.'
             },
             status=status.HTTP_200_OK
         )
 
-    # Check if therapist already has an active/started booking during this time
-    conflicting_booking = Booking.objects.filter(
-        therapist_id=therapist_id,
-        status__in=['active', 'started'],
-        time_slot_from__lt=timeslot_to,
-        time_slot_to__gt=timeslot_from
-    ).exists()
-
-    if conflicting_booking:
+    if check.outcome == SlotCheck.BOOKED:
         return Response(
             {
                 'error': 'Therapist unavailable',
@@ -178,39 +289,17 @@ def send_booking_request(request):
             status=status.HTTP_409_CONFLICT
         )
 
-    from datetime import timedelta
-    two_minutes_ago = timezone.now() - timedelta(minutes=2)
-
-    # Check if THIS customer already has a pending request to this therapist in this time slot
-    own_pending = PendingRequests.objects.filter(
-        customer_id=customer_id,
-        therapist_id=therapist_id,
-        status='pending',
-        created_at__gt=two_minutes_ago,
-        timeslot_from__lt=timeslot_to,
-        timeslot_to__gt=timeslot_from
-    ).first()
-
-    if own_pending:
+    if check.outcome == SlotCheck.OWN_PENDING:
         return Response(
             {
                 'status': 'already_exists',
-                'pending_booking_id': str(own_pending.id),
+                'pending_booking_id': str(check.conflict_id),
                 'message': 'You already have a pending request for this therapist during this time.'
             },
             status=status.HTTP_200_OK
         )
 
-    # Check if a DIFFERENT customer already has a non-expired pending request during this time
-    conflicting_pending = PendingRequests.objects.filter(
-        therapist_id=therapist_id,
-        status='pending',
-        created_at__gt=two_minutes_ago,
-        timeslot_from__lt=timeslot_to,
-        timeslot_to__gt=timeslot_from
-    ).exclude(customer_id=customer_id).exists()
-
-    if conflicting_pending:
+    if check.outcome == SlotCheck.HELD:
         return Response(
             {
                 'error': 'Therapist unavailable',
@@ -219,31 +308,16 @@ def send_booking_request(request):
             status=status.HTTP_409_CONFLICT
         )
 
-    pending = PendingRequests.objects.create(
-        customer_id=customer_id,
-        therapist_id=therapist_id,
-        status='pending',
-        customer_name=getattr(request.user, 'name', None) or str(request.user),
-        services=services,
-        coupon_code=coupon_code,
-        timeslot_from=timeslot_from,
-        timeslot_to=timeslot_to,
-        latitude=latitude,
-        longitude=longitude,
-        distance=distance
-    )
+    pending = check.hold
     
-    try:
-        fcm_token = FCMToken.objects.get(user=therapist)
-        customer_name = getattr(request.user, 'name', None) or str(request.user)
-        send_push_notification(
-            fcm_token.token,
-            "New Booking Request",
-            f"New request from {customer_name} for {services}",
-            {"type": "booking_request", "request_id": str(pending.id)}
-        )
-    except FCMToken.DoesNotExist:
-        pass
+    customer_name = getattr(request.user, 'name', None) or str(request.user)
+    enqueue_push(
+        therapist.id,
+        "New Booking Request",
+        f"New request from {customer_name} for {services}",
+        {"type": "booking_request", "request_id": str(pending.id)}
+    )
+    publish_booking_event([therapist.id], 'booking_request', PendingRequestsSerializer(pending).data)
     
     return Response(
         {
@@ -266,48 +340,45 @@ def respond_to_booking_request(request):
 
     # For reject, also allow acting on already-expired requests so therapist can clear notifications
     allowed_statuses = ['pending', 'expired'] if action == 'reject' else ['pending']
-    try:
-        pending_request = PendingRequests.objects.get(
-            id=request_id,
-            therapist_id=request.user.id,
-            status__in=allowed_statuses
-        )
-    except PendingRequests.DoesNotExist:
-        return Response({
-            'error': 'Request not found or already responded',
-            'message': 'You have already responded to this booking request.'
-        }, status=status.HTTP_409_CONFLICT)
+    pending_store = get_pending_store()
+    pending_request = pending_store.get(request_id)
+    if (
+        pending_request is None
+        or pending_request.therapist_id != str(request.user.id)
+        or pending_request.status not in allowed_statuses
+    ):
+        return already_responded()
+
+    # Every status change below only applies if the request still has the
+    # status read above; one that lost a race to another response or the
+    # sweeper gets a 409 and changes nothing.
 
     # Check if request has expired (older than 2 minutes) — only block accept, not reject
     if action != 'reject' and pending_request.is_expired():
-        pending_request.status = 'expired'
-        pending_request.save()
-        return Response({
-            'error': 'Request has expired',
-            'message': 'This booking request expired because it was not accepted within 2 minutes.'
-        }, status=status.HTTP_410_GONE)
+        if not pending_store.set_status(pending_request, 'expired'):
+            return already_responded()
+        return request_expired()
     
     try:
         customer = User.objects.get(id=pending_request.customer_id)
     except User.DoesNotExist:
-        pending_request.status = 'rejected'
-        pending_request.save()
+        if not pending_store.set_status(pending_request, 'rejected'):
+            return already_responded()
         return Response({'error': 'Customer not found'}, status=status.HTTP_404_NOT_FOUND)
     
     if action == 'reject':
-        pending_request.status = 'rejected'
-        pending_request.save()
+        if not pending_store.set_status(pending_request, 'rejected'):
+            return already_responded()
         
-        try:
-            fcm_token = FCMToken.objects.get(user=customer)
-            send_push_notification(
-                fcm_token.token,
-                "Booking Request Declined",
-                "Your therapist is currently busy",
-                {"type": "booking_rejected", "request_id": str(pending_request.id)}
-            )
-        except FCMToken.DoesNotExist:
-            pass
+        enqueue_push(
+            customer.id,
+            "Booking Request Declined",
+            "Your therapist is currently busy",
+            {"type": "booking_rejected", "request_id": str(pending_request.id)}
+        )
+        publish_booking_event(
+            [customer.id, request.user.id], 'booking_rejected', {'request_id': str(pending_request.id)}
+        )
         
         return Response({
             'accepted': False,
@@ -315,121 +386,98 @@ def respond_to_booking_request(request):
         }, status=status.HTTP_200_OK)
     
     elif action == 'accept':
-        # Check for overlapping active/started bookings before accepting
-        conflicting_booking = Booking.objects.filter(
-            therapist=request.user,
-            status__in=['active', 'started'],
-            time_slot_from__lt=pending_request.timeslot_to,
-            time_slot_to__gt=pending_request.timeslot_from
-        ).exists()
-
-        if conflicting_booking:
-            pending_request.status = 'rejected'
-            pending_request.save()
-
-            try:
-                fcm_token = FCMToken.objects.get(user=customer)
-                send_push_notification(
-                    fcm_token.token,
-                    "Booking Request Declined",
-                    "Your therapist is already booked during this time slot",
-                    {"type": "booking_rejected", "request_id": str(pending_request.id)}
-                )
-            except FCMToken.DoesNotExist:
-                pass
-
-            return Response({
-                'accepted': False,
-                'error': 'Time slot conflict',
-                'message': 'You already have a booking during this time slot.'
-            }, status=status.HTTP_409_CONFLICT)
-
         # Calculate actual total from therapist's service prices
-        total_amount = Decimal('0.00')
-        try:
-            import ast
-            from therapist.models import Services as TherapistServices
-
-            therapist_services = TherapistServices.objects.filter(user=request.user).first()
-
-            # Parse services string to dict
-            if isinstance(pending_request.services, str):
-                try:
-                    requested_services = ast.literal_eval(pending_request.services)
-                except:
-                    requested_services = {}
-            else:
-                requested_services = pending_request.services or {}
-
-            # Calculate total from therapist's pricing
-            if therapist_services and therapist_services.services:
-                for service_name, quantity in requested_services.items():
-                    # Try to find price by exact match first
-                    price_per_service = therapist_services.services.get(service_name, 0)
-
-                    # If not found, try alternative formats
-                    if price_per_service == 0:
-                        # Convert spaces to underscores: "4 hands oil" -> "4_hands_oil"
-                        alt_name = service_name.replace(' ', '_')
-                        price_per_service = therapist_services.services.get(alt_name, 0)
-
-                        # Try other common variations
-                        if price_per_service == 0:
-                            alt_name = service_name.replace('_', ' ')
-                            price_per_service = therapist_services.services.get(alt_name, 0)
-
-                    # Set default quantity to 1 if it's 0 (assuming they want the service)
-                    actual_quantity = int(quantity) if quantity and int(quantity) > 0 else 1
-                    total_amount += Decimal(str(price_per_service)) * Decimal(str(actual_quantity))
-        except:
-            total_amount = Decimal('0.00')
+        subtotal = pricing.quote(request.user.id, pending_request.services).total
 
         # Handle coupon application
         coupon = None
         coupon_discount = Decimal('0.00')
-        subtotal = total_amount
+        redeem_coupon = False
 
         if pending_request.coupon_code:
             try:
                 coupon = Coupon.objects.get(code=pending_request.coupon_code.upper())
                 if coupon.is_valid() and coupon.can_apply_to_amount(subtotal):
                     coupon_discount = coupon.calculate_discount(subtotal)
-                    total_amount = subtotal - coupon_discount
-                    # Increment usage count
-                    coupon.used_count += 1
-                    coupon.save()
+                    redeem_coupon = True
             except Coupon.DoesNotExist:
                 pass  # Invalid coupon, proceed without discount
 
-        booking = Booking.objects.create(
-            customer=customer,
-            therapist=request.user,
-            time_slot_from=pending_request.timeslot_from,
-            time_slot_to=pending_request.timeslot_to,
-            services=pending_request.services,
-            subtotal=subtotal,
-            coupon=coupon,
-            coupon_discount=coupon_discount,
-            total=total_amount,
-            latitude=pending_request.latitude,
-            longitude=pending_request.longitude,
-            distance=pending_request.distance,
-            status='active'
-        )
-        
-        pending_request.status = 'accepted'
-        pending_request.save()
-        
+        def create_booking():
+            discount = coupon_discount
+            # Counted in the booking's transaction; a coupon used up since the
+            # check above is recorded without a discount
+            if redeem_coupon and not coupon.redeem():
+                discount = Decimal('0.00')
+
+            booking = Booking.objects.create(
+                customer=customer,
+                therapist=request.user,
+                time_slot_from=pending_request.timeslot_from,
+                time_slot_to=pending_request.timeslot_to,
+                services=pending_request.services,
+                subtotal=subtotal,
+                coupon=coupon,
+                coupon_discount=discount,
+                total=subtotal - discount,
+                latitude=pending_request.latitude,
+                longitude=pending_request.longitude,
+                distance=pending_request.distance,
+                status='active'
+            )
+
+            # Last, as the Redis store cannot undo it; a request answered or
+            # expired meanwhile rolls back the booking and the redemption
+            if not pending_store.set_status(pending_request, 'accepted'):
+                raise RequestResolved(pending_request.id)
+            return booking
+
+        # Only bookings block an accept: this request is itself the pending hold
         try:
-            fcm_token = FCMToken.objects.get(user=customer)
-            send_push_notification(
-                fcm_token.token,
-                "Booking Confirmed",
-                "Your booking request has been accepted",
-                {"type": "booking_accepted", "booking_id": str(booking.id)}
+            check = check_and_hold(
+                request.user, pending_request.timeslot_from, pending_request.timeslot_to,
+                include_pending=False, hold=create_booking
+            )
+        except RequestResolved:
+            current = pending_store.get(request_id)
+            if current is not None and current.status == 'expired':
+                return request_expired()
+            return already_responded()
+
+        if not check.ok:
+            # The booking in the way may be this very request's, made by a
+            # parallel accept that held the therapist's lock first
+            if not pending_store.set_status(pending_request, 'rejected'):
+                return already_responded()
+
+            enqueue_push(
+                customer.id,
+                "Booking Request Declined",
+                "Your therapist is already booked during this time slot",
+                {"type": "booking_rejected", "request_id": str(pending_request.id)}
+            )
+            publish_booking_event(
+                [customer.id, request.user.id], 'booking_rejected', {'request_id': str(pending_request.id)}
             )
-        except FCMToken.DoesNotExist:
-            pass
+
+            return Response({
+                'accepted': False,
+                'error': 'Time slot conflict',
+                'message': 'You already have a booking during this time slot.'
+            }, status=status.HTTP_409_CONFLICT)
+
+        booking = check.hold
+        
+        enqueue_push(
+            customer.id,
+            "Booking Confirmed",
+            "Your booking request has been accepted",
+            {"type": "booking_accepted", "booking_id": str(booking.id)}
+        )
+        publish_booking_event(
+            [customer.id, request.user.id], 'booking_accepted',
+            {'request_id': str(pending_request.id), 'booking_id': str(booking.id)}
+        )
         
         return Response({
             'accepted': True,
@@ -450,6 +498,11 @@ def list_bookings(request):
     ts_to_raw         = request.data.get('time_slot_to')
     distance_max      = request.data.get('distance')
 
+    try:
+        limit, after, since = parse_page_params(request.data)
+    except (TypeError, ValueError):
+        return Response({"error": "Invalid limit, cursor or since"}, status=400)
+
     qs = Booking.objects.all()
 
     if therapist_id:
@@ -488,8 +541,18 @@ def list_bookings(request):
             return Response({"error": "Invalid numeric value for distance"}, status=400)
         qs = qs.filter(distance__lte=dist_val)
 
-    serializer = BookingSerializer(qs, many=True)
-    return Response(serializer.data, status=200)
+    if since:
+        qs = qs.filter(created_at__gt=since)
+    if limit is None:
+        serializer = BookingSerializer(qs, many=True)
+        return Response(serializer.data, status=200)
+
+    # Paged newest first on (created_at, id) when a limit or cursor is given
+    if after:
+        qs = qs.filter(keyset_filter(after))
+    page, next_cursor = keyset_page(BookingSerializer.eager(qs.order_by(*KEYSET_ORDERING))[:limit + 1], limit)
+    serializer = BookingSerializer(page, many=True)
+    return Response({'results': serializer.data, 'next_cursor': next_cursor}, status=200)
 
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
@@ -532,20 +595,25 @@ def update_booking_status(request, booking_id):
 @api_view(['GET', 'PATCH'])
 @permission_classes([IsAuthenticated])
 def pending_requests_list(request):
+    pending_store = get_pending_store()
     if request.method == 'PATCH':
         req_id = request.data.get('id')
-        pending = get_object_or_404(
-            PendingRequests,
-            id=req_id,
-            therapist_id=request.user.id
-        )
+        pending = pending_store.get(req_id)
+        if pending is None or pending.therapist_id != str(request.user.id):
+            raise Http404
         if pending.status not in ['pending', 'expired']:
             return Response(
                 {'error': 'Only pending requests can be cancelled'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        pending.status = 'cancelled'
-        pending.save()
+        if not pending_store.set_status(pending, 'cancelled'):
+            return Response(
+                {'error': 'Only pending requests can be cancelled'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        publish_booking_event(
+            [pending.customer_id, pending.therapist_id], 'booking_cancelled', {'request_id': str(pending.id)}
+        )
         serializer = PendingRequestsSerializer(pending)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -553,50 +621,90 @@ def pending_requests_list(request):
     status_filter = request.query_params.get('status')
 
     if req_id:
-        pending = get_object_or_404(PendingRequests, id=req_id)
-        # Auto-expire if needed
-        pending.auto_expire_if_needed()
+        pending = pending_store.get(req_id)
+        if pending is None:
+            raise Http404
         serializer = PendingRequestsSerializer(pending)
         return Response(serializer.data)
 
     # Automatically detect role from authenticated user
     user_role = getattr(request.user, 'role', 'therapist')
 
-    # Filter by role: therapist or customer
-    if user_role == 'customer':
-        qs = PendingRequests.objects.filter(customer_id=str(request.user.id))
-    else:
-        qs = PendingRequests.objects.filter(therapist_id=str(request.user.id))
-
-    # Auto-expire old pending requests
-    from datetime import timedelta
-    two_minutes_ago = timezone.now() - timedelta(minutes=2)
-    old_pending = qs.filter(status='pending', created_at__lt=two_minutes_ago)
-    old_pending.update(status='expired')
-
-    # Apply status filter if provided
-    if status_filter:
-        qs = qs.filter(status=status_filter)
+    try:
+        limit, after, since = parse_page_params(request.query_params)
+    except (TypeError, ValueError):
+        return Response({'error': 'Invalid limit, cursor or since'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Filter by role and status; expiry is done by the
+    # expire_pending_requests sweeper, so reads never write
+    if limit is None:
+        qs = pending_store.for_user(user_role, request.user.id, status_filter, since=since)
+        serializer = PendingRequestsSerializer(qs, many=True)
+        return Response(serializer.data)
 
-    serializer = PendingRequestsSerializer(qs, many=True)
-    return Response(serializer.data)
+    rows = pending_store.for_user(user_role, request.user.id, status_filter, since=since, after=after, limit=limit + 1)
+    page, next_cursor = keyset_page(rows, limit)
+    serializer = PendingRequestsSerializer(page, many=True)
+    return Response({'results': serializer.data, 'next_cursor': next_cursor})
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def booking_detail_view(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id)
+    booking = get_object_or_404(BookingSerializer.eager(Booking.objects.all()), id=booking_id)
     if request.user != booking.customer and request.user != booking.therapist:
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
     serializer = BookingSerializer(booking)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def booking_changes(request):
+    """
+    Bookings and pending requests of the user written since the sync token
+    in ?since=, oldest change first, and the token to send next time.
+    Without since the feed starts from the beginning. has_more means a
+    table had more than CHANGES_PAGE_SIZE changes and the client should ask
+    again straight away. Rows written in the last CHANGES_OVERLAP are sent
+    again on the next poll, so clients must upsert by id. With the Redis
+    pending store a request shows up here once it has been answered.
+    """
+    token = request.query_params.get('since')
+    try:
+        positions = decode_sync_token(token, 2) if token else [(SYNC_START, None)] * 2
+    except (TypeError, ValueError):
+        return Response({'error': 'Invalid since token'}, status=status.HTTP_400_BAD_REQUEST)
+
+    now = timezone.now()
+    user = request.user
+    feeds = [
+        BookingSerializer.eager(Booking.objects.filter(Q(customer=user) | Q(therapist=user))),
+        PendingRequests.objects.filter(Q(customer_id=str(user.id)) | Q(therapist_id=str(user.id))),
+    ]
+    pages = []
+    next_positions = []
+    has_more = False
+    for qs, position in zip(feeds, positions):
+        rows = list(qs.filter(changed_after(position)).order_by('updated_at', 'id')[:CHANGES_PAGE_SIZE + 1])
+        if len(rows) > CHANGES_PAGE_SIZE:
+            rows = rows[:CHANGES_PAGE_SIZE]
+            has_more = True
+            next_positions.append((rows[-1].updated_at, str(rows[-1].id)))
+        else:
+            # Caught up. A write stamped just before now may not have
+            # committed yet, so the next poll looks back CHANGES_OVERLAP.
+            next_positions.append((max(position[0], now - CHANGES_OVERLAP), None))
+        pages.append(rows)
+
+    return Response({
+        'bookings': BookingSerializer(pages[0], many=True).data,
+        'pending_requests': PendingRequestsSerializer(pages[1], many=True).data,
+        'next_since': encode_sync_token(next_positions),
+        'has_more': has_more,
+    }, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsTherapist])
 def therapist_analytics(request):
-    from datetime import timedelta
-    from django.db.models import Sum
-    from decimal import Decimal
-
     therapist_id = request.query_params.get('therapist_id', str(request.user.id))
 
     # Ensure therapist can only see their own analytics
@@ -605,54 +713,21 @@ def therapist_analytics(request):
 
     now = timezone.now()
 
-    # Date ranges
-    last_7_days = now - timedelta(days=7)
-    last_30_days = now - timedelta(days=30)
-    last_365_days = now - timedelta(days=365)
-
     # Base queryset for completed bookings
     base_qs = Booking.objects.filter(
-        therapist_id=therapist_id,
+        therapist_id=request.user.id,
         status='completed'
     )
 
-    # Analytics for different periods
-    def get_period_analytics(start_date):
-        period_bookings = base_qs.filter(completed_at__gte=start_date)
-        total_revenue = period_bookings.aggregate(
-            revenue=Sum('total')
-        )['revenue'] or Decimal('0.00')
-        total_orders = period_bookings.count()
-
-        return {
-            'total_revenue': float(total_revenue),
-            'total_orders': total_orders,
-            'average_order_value': float(total_revenue / total_orders) if total_orders > 0 else 0.0
-        }
-
-    # Weekly revenue breakdown (last 7 days)
-    weekly_revenue = []
-    for i in range(7):
-        day_start = (now - timedelta(days=i)).replace(hour=0, minute=0, second=0, microsecond=0)
-        day_end = day_start + timedelta(days=1)
-
-        day_bookings = base_qs.filter(
-            completed_at__gte=day_start,
-            completed_at__lt=day_end
-        )
-
-        day_revenue = day_bookings.aggregate(revenue=Sum('total'))['revenue'] or Decimal('0.00')
-        day_orders = day_bookings.count()
-
-        weekly_revenue.append({
-            'date': day_start.strftime('%Y-%m-%d'),
-            'day_name': day_start.strftime('%A'),
-            'revenue': float(day_revenue),
-            'orders': day_orders
-        })
+    # Every total comes from one conditional aggregate, and the weekly and
+    # monthly breakdowns from one query grouped by day
+    totals = analytics.period_totals(
+        base_qs, now, [('last_7_days', 7), ('last_30_days', 30), ('last_365_days', 365)]
+    )
+    weekly_revenue, monthly_trends = analytics.daily_and_monthly(base_qs, now)
 
     # Recent orders (last 10 completed bookings)
-    recent_orders = base_qs.order_by('-completed_at')[:10]
+    recent_orders = base_qs.select_related('customer').order_by('-completed_at')[:10]
     recent_orders_data = []
 
     for booking in recent_orders:
@@ -665,66 +740,14 @@ def therapist_analytics(request):
             'duration': str(booking.time_slot_to - booking.time_slot_from) if booking.time_slot_to and booking.time_slot_from else None
         })
 
-    # Service popularity (from completed bookings)
-    service_stats = {}
-    for booking in base_qs.filter(completed_at__gte=last_30_days):
-        if isinstance(booking.services, dict):
-            services = booking.services
-        elif isinstance(booking.services, str):
-            try:
-                import ast
-                services = ast.literal_eval(booking.services)
-            except:
-                services = {}
-        else:
-            services = {}
-
-        for service_name, quantity in services.items():
-            if service_name not in service_stats:
-                service_stats[service_name] = {'count': 0, 'revenue': 0.0}
-            service_stats[service_name]['count'] += int(quantity) if quantity else 1
-
-    # Convert service stats to list
-    popular_services = []
-    for service, stats in service_stats.items():
-        popular_services.append({
-            'service_name': service,
-            'booking_count': stats['count']
-        })
-    popular_services = sorted(popular_services, key=lambda x: x['booking_count'], reverse=True)[:5]
-
-    # Monthly trends (last 12 months)
-    monthly_trends = []
-    for i in range(12):
-        month_start = (now.replace(day=1) - timedelta(days=32*i)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        next_month = (month_start + timedelta(days=32)).replace(day=1)
-
-        month_bookings = base_qs.filter(
-            completed_at__gte=month_start,
-            completed_at__lt=next_month
-        )
-
-        month_revenue = month_bookings.aggregate(revenue=Sum('total'))['revenue'] or Decimal('0.00')
-        month_orders = month_bookings.count()
-
-        monthly_trends.append({
-            'month': month_start.strftime('%Y-%m'),
-            'month_name': month_start.strftime('%B %Y'),
-            'revenue': float(month_revenue),
-            'orders': month_orders
-        })
-
-    # Reverse to show oldest to newest
-    monthly_trends.reverse()
-
     return Response({
         'therapist_id': therapist_id,
         'generated_at': now.isoformat(),
 
         # Period analytics
-        'last_7_days': get_period_analytics(last_7_days),
-        'last_30_days': get_period_analytics(last_30_days),
-        'last_365_days': get_period_analytics(last_365_days),
+        'last_7_days': totals['last_7_days'],
+        'last_30_days': totals['last_30_days'],
+        'last_365_days': totals['last_365_days'],
 
         # Weekly breakdown
         'weekly_revenue_breakdown': weekly_revenue,
@@ -733,14 +756,16 @@ def therapist_analytics(request):
         'recent_orders': recent_orders_data,
 
         # Service insights
-        'popular_services': popular_services,
+        'popular_services': analytics.popular_services(
+            request.user.id, now - timedelta(days=analytics.POPULAR_SERVICES_DAYS)
+        ),
 
         # Trends
         'monthly_trends': monthly_trends,
 
         # Summary stats
-        'total_lifetime_revenue': float(base_qs.aggregate(revenue=Sum('total'))['revenue'] or Decimal('0.00')),
-        'total_lifetime_orders': base_qs.count(),
+        'total_lifetime_revenue': totals['lifetime']['total_revenue'],
+        'total_lifetime_orders': totals['lifetime']['total_orders'],
         'total_pending_requests': PendingRequests.objects.filter(
             therapist_id=therapist_id,
             status='pending'
@@ -5,6 +5,7 @@ from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from chat.models import Conversation, Message
+from booking.events import booking_group
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -245,6 +246,34 @@ class LocationConsumer(AsyncWebsocketConsumer):
             'therapist_id': event['therapist_id'],
         }))
 
+class BookingEventsConsumer(AsyncWebsocketConsumer):
+    """Pushes booking request events for the connected user"""
+
+    async def connect(self):
+        user = self.scope['user']
+        if not user.is_authenticated:
+            logger.warning(f"[BookingEventsConsumer] Connection rejected - user not authenticated")
+            await self.close(code=4001)
+            return
+
+        self.group_name = booking_group(user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        logger.info(f"[BookingEventsConsumer] Connection accepted for user {user.id} (role: {user.role})")
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            try:
+                await self.channel_layer.group_discard(self.group_name, self.channel_name)
+            except Exception as e:
+                logger.error(f"[BookingEventsConsumer] Error removing from group: {e}")
+
+    async def booking_event(self, event):
+        await self.send(text_data=json.dumps({
+            'type': event['event'],
+            'data': event['data'],
+        }))
+
 class TestConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         await self.accept()
@@ -195,11 +195,27 @@ done
 echo "📋 Current migration status:"
 python manage.py showmigrations
 
+# Booking services used to be saved as Python reprs, which cannot be cast to jsonb
+echo "🔄 Converting booking services to JSON..."
+python manage.py convert_request_services
+
 # Apply migrations with detailed output
 echo "🔄 Applying migrations..."
 python manage.py migrate --verbosity 2
 echo "✅ Migrations applied"
 
+# Fill search index columns for rows saved before those columns existed
+echo "🔄 Backfilling therapist search indexes..."
+python manage.py backfill_service_masks
+
+# Fill duplicate-check hashes for requests saved before that column existed
+echo "🔄 Backfilling pending request hashes..."
+python manage.py backfill_request_hashes
+
+# Give bookings and requests saved before the changes feed existed an updated_at
+echo "🔄 Backfilling booking update times..."
+python manage.py backfill_updated_at
+
 # Show migration status after applying
 echo "📋 Updated migration status:"
 python manage.py showmigrations
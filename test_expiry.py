@@ -26,7 +26,7 @@ test_request = PendingRequests.objects.create(
     therapist_id="2",
     status='pending',
     customer_name="Test Customer",
-    services="{'test': 1}",
+    services={'test': 1},
     timeslot_from=timezone.now() + timedelta(hours=1),
     timeslot_to=timezone.now() + timedelta(hours=2),
     latitude=19.076,
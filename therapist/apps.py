@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class TherapistConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'therapist'
+
+    def ready(self):
+        # Keep search snapshots current when a therapist's profile changes
+        # outside the therapist views, e.g. from the admin panel
+        from . import signals
+        signals.connect()
@@ -0,0 +1,68 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+# The therapist snapshot buckets coordinates into fixed 0.05 x 0.05 degree
+# cells (roughly 5.5km on a side at the equator). A search only has to look
+# at the cells overlapping its radius instead of every therapist on the
+# platform.
+CELL_SIZE_DEGREES = 0.05
+
+
+def cell_for(latitude, longitude):
+    """Return the (row, col) grid cell containing the given coordinates"""
+    if latitude is None or longitude is None:
+        return None, None
+    row = int(math.floor(float(latitude) / CELL_SIZE_DEGREES))
+    col = int(math.floor(float(longitude) / CELL_SIZE_DEGREES))
+    return row, col
+
+
+def cell_ranges(latitude, longitude, radius_km):
+    """
+    Return the inclusive row and column ranges of the cells overlapping a
+    circle of radius_km around the point. The column range is None when the
+    circle reaches a pole or crosses the antimeridian, in which case only the
+    rows can be used to narrow candidates.
+    """
+    lat = float(latitude)
+    lon = float(longitude)
+    # In degrees of the same sphere haversine_many measures on
+    delta_lat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    lat_min = max(-90.0, lat - delta_lat)
+    lat_max = min(90.0, lat + delta_lat)
+
+    rows = (
+        int(math.floor(lat_min / CELL_SIZE_DEGREES)),
+        int(math.floor(lat_max / CELL_SIZE_DEGREES)),
+    )
+
+    # A degree of longitude is shortest at the latitude closest to a pole,
+    # so that latitude gives the widest span the circle can cover.
+    widest_lat = max(abs(lat_min), abs(lat_max))
+    if widest_lat >= 89.9:
+        return rows, None
+    delta_lon = delta_lat / math.cos(math.radians(widest_lat))
+    if lon - delta_lon < -180.0 or lon + delta_lon > 180.0:
+        return rows, None
+
+    cols = (
+        int(math.floor((lon - delta_lon) / CELL_SIZE_DEGREES)),
+        int(math.floor((lon + delta_lon) / CELL_SIZE_DEGREES)),
+    )
+    return rows, cols
+
+
+def haversine_many(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distance in km from one point to every point in the given
+    float arrays, computed in a single vectorised pass.
+    """
+    phi1 = math.radians(latitude)
+    phi2 = np.radians(latitudes)
+    dphi = phi2 - phi1
+    dlambda = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from therapist.models import Services
+
+
+class Command(BaseCommand):
+    help = 'Compute service bitmasks for therapist services that do not have one yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', help='Recompute masks for every row')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        qs = Services.objects.all()
+        if not options['all']:
+            qs = qs.filter(service_mask__isnull=True)
+
+        batch = []
+        updated = 0
+        for serv_obj in qs.only('id', 'services').iterator(chunk_size=batch_size):
+            serv_obj.service_mask = Services.mask_for(serv_obj.services or {})
+            batch.append(serv_obj)
+            if len(batch) >= batch_size:
+                Services.objects.bulk_update(batch, ['service_mask'])
+                updated += len(batch)
+                batch = []
+        if batch:
+            Services.objects.bulk_update(batch, ['service_mask'])
+            updated += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated service masks for {updated} therapists'))
@@ -21,6 +21,25 @@ class Services(models.Model):
     ]
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='therapist_services')
     services = models.JSONField(blank=True, default=dict)
+    # One bit per SERVICE_CHOICES entry offered, so service filters are a
+    # bitwise AND instead of a JSON key scan
+    service_mask = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+
+    @classmethod
+    def mask_for(cls, service_keys):
+        """Bitmask with one bit per SERVICE_CHOICES entry found in service_keys"""
+        mask = 0
+        for bit, (key, _) in enumerate(cls.SERVICE_CHOICES):
+            if key in service_keys:
+                mask |= 1 << bit
+        return mask
+
+    def save(self, *args, **kwargs):
+        self.service_mask = self.mask_for(self.services or {})
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'services' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'service_mask'}
+        super().save(*args, **kwargs)
 
 class BankDetails(models.Model):
     user = models.ForeignKey(
@@ -0,0 +1,26 @@
+from .models import Services
+from .snapshot import get_snapshot
+
+
+def nearest_therapists(latitude, longitude, radius_km, k=None, services=None, match_all=False):
+    """
+    Return (therapist, distance_km) pairs for available therapists within
+    radius_km of the point, nearest first and at most k of them. therapist
+    is the dict search responses are built from (id, name, email,
+    profile_picture, address, services). services keeps therapists offering
+    any of the given service keys, or all of them with match_all.
+
+    Answered from this worker's in-memory snapshot without queries once it
+    is loaded. Unlike search's nearest mode, a therapist's own service
+    radius is not considered.
+    """
+    service_mask = Services.mask_for(services) if services else 0
+    if services and not service_mask:
+        return []
+    if match_all and services and not all(Services.mask_for([s]) for s in services):
+        return []
+    if k is not None and k < 1:
+        return []
+    return get_snapshot().nearest(
+        float(latitude), float(longitude), float(radius_km), service_mask, match_all, k=k
+    )
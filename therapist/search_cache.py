@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import math
+import threading
+from django.core.cache import cache
+from .geo import KM_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+# Customers in the same 0.005 degree (~550m) cell share one cache entry:
+# the ids of the therapists who could match from anywhere in the cell,
+# found from its centre with the radius widened by SLACK_KM. Each search
+# then measures and filters those candidates from its own coordinates.
+# Entries are short-lived and carry the version they were stored under;
+# every therapist change moves the version, which orphans all previously
+# cached results at once.
+QUANTUM_DEGREES = 0.005
+# Furthest a point can be from its cell's centre; KM_PER_DEGREE is above
+# the length of a degree of latitude or longitude, so this never falls short
+SLACK_KM = math.hypot(QUANTUM_DEGREES / 2, QUANTUM_DEGREES / 2) * KM_PER_DEGREE
+TTL_SECONDS = 30
+# Nearest-mode entries keep at most this many candidates, closest to the
+# cell's centre first; see covers()
+MAX_CANDIDATES = 500
+# Hits and misses are counted in-process and added to the shared counters
+# every this many lookups, so counting costs no round trip per search
+COUNT_FLUSH_EVERY = 100
+
+VERSION_KEY = 'therapist-search:version'
+HITS_KEY = 'therapist-search:hits'
+MISSES_KEY = 'therapist-search:misses'
+
+_counts = {HITS_KEY: 0, MISSES_KEY: 0}
+_counts_lock = threading.Lock()
+
+
+def quantize(latitude, longitude):
+    """The centre of the cache cell containing the coordinates"""
+    lat = (math.floor(latitude / QUANTUM_DEGREES) + 0.5) * QUANTUM_DEGREES
+    lon = (math.floor(longitude / QUANTUM_DEGREES) + 0.5) * QUANTUM_DEGREES
+    return round(lat, 6), round(lon, 6)
+
+
+def cache_key(latitude, longitude, radius_km, services, **options):
+    """
+    Key for a search at already-quantized coordinates. Services are sorted
+    so the same filter in a different order shares the entry; any other
+    parameter that changes the candidates goes in options.
+    """
+    parts = [
+        f'{latitude:.6f}', f'{longitude:.6f}', f'{radius_km:g}',
+        ','.join(sorted(set(services))),
+    ] + [f'{name}={options[name]}' for name in sorted(options)]
+    digest = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+    return f'therapist-search:{digest}'
+
+
+def _add(key, amount):
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key, amount)
+
+
+def _flush_counts():
+    with _counts_lock:
+        pending = dict(_counts)
+        for key in _counts:
+            _counts[key] = 0
+    for key, amount in pending.items():
+        if amount:
+            _add(key, amount)
+
+
+def _count(key):
+    with _counts_lock:
+        _counts[key] += 1
+        due = sum(_counts.values()) >= COUNT_FLUSH_EVERY
+    if due:
+        _flush_counts()
+
+
+def lookup(key):
+    """
+    Return (entry, version) for key in a single round trip. entry is the
+    cached {'ids', 'bound'} dict, or None on a miss; version is what a
+    result computed now should be stored under, or None when the cache is
+    unreachable.
+    """
+    try:
+        found = cache.get_many([VERSION_KEY, key])
+        version = found.get(VERSION_KEY)
+        if version is None:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            version = cache.get(VERSION_KEY, 1)
+        data = found.get(key)
+        entry = data['entry'] if data is not None and data['version'] == version else None
+        _count(HITS_KEY if entry is not None else MISSES_KEY)
+        return entry, version
+    except Exception as e:
+        logger.warning(f"[SearchCache] Cache unavailable: {e}")
+        return None, None
+
+
+def store(key, version, ids, bound=None):
+    """
+    Cache candidate ids for key under version. bound is None when ids holds
+    every candidate; otherwise ids holds every candidate closer than bound
+    km to the cell's centre, and possibly some at exactly bound.
+    """
+    try:
+        cache.set(key, {'version': version, 'entry': {'ids': ids, 'bound': bound}}, timeout=TTL_SECONDS)
+    except Exception as e:
+        logger.warning(f"[SearchCache] Store failed: {e}")
+
+
+def covers(entry, matches, wanted):
+    """
+    Whether matches, found among entry's candidates, are exactly what a
+    search of every therapist would return when it wants up to wanted of
+    them. A capped entry only answers for distances short enough that no
+    therapist left out of it could be closer to the customer.
+    """
+    if entry['bound'] is None:
+        return True
+    return len(matches) >= wanted and matches[wanted - 1][1] < entry['bound'] - SLACK_KM
+
+
+def invalidate():
+    """Drop every cached search result by moving to a new version"""
+    try:
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, timeout=None)
+            cache.incr(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"[SearchCache] Could not invalidate search cache: {e}")
+
+
+def stats():
+    try:
+        _flush_counts()
+        counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    except Exception as e:
+        logger.warning(f"[SearchCache] Could not read cache stats: {e}")
+        counts = {}
+    hits = counts.get(HITS_KEY, 0)
+    misses = counts.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / total, 4) if total else 0.0,
+    }
@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from api.models import Pictures
+from .snapshot import publish_therapist_change, therapist_snapshot
+
+User = get_user_model()
+
+
+def _publish_after_commit(user_id):
+    transaction.on_commit(lambda: publish_therapist_change(user_id))
+
+
+def therapist_saved(sender, instance, **kwargs):
+    """A therapist's name or email shows in search results, so other workers need the edit"""
+    if instance.role != 'therapist':
+        return
+    # Logins and most other saves leave the snapshot's copy as it is
+    if therapist_snapshot.shows(instance.id, name=instance.name, email=instance.email):
+        return
+    _publish_after_commit(instance.id)
+
+
+def therapist_deleted(sender, instance, **kwargs):
+    if instance.role == 'therapist':
+        _publish_after_commit(instance.id)
+
+
+def pictures_saved(sender, instance, **kwargs):
+    if therapist_snapshot.shows(instance.user_id, profile_picture=instance.profile_picture):
+        return
+    if not User.objects.filter(id=instance.user_id, role='therapist').exists():
+        return
+    _publish_after_commit(instance.user_id)
+
+
+def connect():
+    post_save.connect(therapist_saved, sender=User, dispatch_uid='therapist-snapshot-user-saved')
+    post_delete.connect(therapist_deleted, sender=User, dispatch_uid='therapist-snapshot-user-deleted')
+    post_save.connect(pictures_saved, sender=Pictures, dispatch_uid='therapist-snapshot-pictures-saved')
@@ -0,0 +1,397 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connection
+from django_redis import get_redis_connection
+from .geo import cell_for, cell_ranges, haversine_many
+from .models import Services
+from . import search_cache
+from booking import pricing
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+CHANNEL = 'therapist-changes'
+
+# A full reload is forced when the snapshot gets older than this. While the
+# pub/sub listener is connected the snapshot is kept current incrementally,
+# so the reload is only a safety net; without it changes from other workers
+# are invisible, so the snapshot is reloaded much sooner.
+MAX_AGE_LISTENING = 300
+MAX_AGE_NOT_LISTENING = 15
+RECONNECT_DELAY = 5
+
+
+class TherapistSnapshot:
+    """
+    Array-backed in-memory copy of every available therapist: coordinates,
+    service radius and service bitmask live in parallel NumPy arrays, and the
+    data the search response needs lives in a matching list of payloads.
+    Removal swaps the last row into the hole, so the arrays stay dense.
+    Rows with coordinates are also bucketed by grid cell (see therapist.geo),
+    so a search only measures the rows in the cells its radius overlaps.
+    """
+
+    def __init__(self, capacity=1024):
+        self._lock = threading.RLock()
+        self._allocate(capacity)
+        self.loaded_at = None
+
+    # Everything _allocate sets up, swapped in as a whole by load()
+    _STATE = (
+        '_size', '_index', 'ids', 'latitudes', 'longitudes', 'radii', 'service_masks', 'payloads', 'cells',
+        '_buckets',
+    )
+
+    def _allocate(self, capacity):
+        self._size = 0
+        self._index = {}
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.latitudes = np.full(capacity, np.nan)
+        self.longitudes = np.full(capacity, np.nan)
+        self.radii = np.zeros(capacity)
+        self.service_masks = np.zeros(capacity, dtype=np.int64)
+        self.payloads = [None] * capacity
+        self.cells = [None] * capacity
+        self._buckets = {}
+
+    def _grow(self):
+        capacity = len(self.ids) * 2
+        self.ids = np.resize(self.ids, capacity)
+        self.latitudes = np.resize(self.latitudes, capacity)
+        self.longitudes = np.resize(self.longitudes, capacity)
+        self.radii = np.resize(self.radii, capacity)
+        self.service_masks = np.resize(self.service_masks, capacity)
+        self.payloads.extend([None] * (capacity - len(self.payloads)))
+        self.cells.extend([None] * (capacity - len(self.cells)))
+
+    def __len__(self):
+        return self._size
+
+    def _place(self, row, cell):
+        """Move row into the bucket of cell, or out of every bucket for None"""
+        old = self.cells[row]
+        if old == cell:
+            return
+        if old is not None:
+            bucket = self._buckets[old]
+            bucket.discard(row)
+            if not bucket:
+                del self._buckets[old]
+        if cell is not None:
+            self._buckets.setdefault(cell, set()).add(row)
+        self.cells[row] = cell
+
+    @staticmethod
+    def _queryset():
+        return User.objects.filter(
+            role='therapist',
+            therapist_status__status='available'
+        ).select_related('therapist_address', 'therapist_services', 'therapist_pictures')
+
+    def _put(self, user):
+        addr = getattr(user, 'therapist_address', None)
+        serv_obj = getattr(user, 'therapist_services', None)
+        services = serv_obj.services if serv_obj else {}
+        try:
+            profile_picture = user.therapist_pictures.profile_picture
+        except Exception:
+            profile_picture = None
+
+        row = self._index.get(user.id)
+        if row is None:
+            if self._size == len(self.ids):
+                self._grow()
+            row = self._size
+            self._size += 1
+            self._index[user.id] = row
+
+        has_coordinates = addr is not None and addr.latitude is not None and addr.longitude is not None
+        self.ids[row] = user.id
+        self.latitudes[row] = float(addr.latitude) if has_coordinates else np.nan
+        self.longitudes[row] = float(addr.longitude) if has_coordinates else np.nan
+        self._place(row, cell_for(addr.latitude, addr.longitude) if has_coordinates else None)
+        self.radii[row] = float(addr.service_radius) if addr is not None else 0.0
+        if serv_obj is None:
+            self.service_masks[row] = 0
+        elif serv_obj.service_mask is None:
+            self.service_masks[row] = Services.mask_for(services or {})
+        else:
+            self.service_masks[row] = serv_obj.service_mask
+        self.payloads[row] = {
+            'id': user.id,
+            'name': user.name,
+            'email': user.email,
+            'profile_picture': profile_picture,
+            'address': {
+                'address': addr.address if addr is not None else None,
+                'coordinates': {
+                    'latitude': addr.latitude if addr is not None else None,
+                    'longitude': addr.longitude if addr is not None else None
+                }
+            },
+            'services': services or {},
+        }
+
+    def _remove(self, user_id):
+        row = self._index.pop(user_id, None)
+        if row is None:
+            return
+        last = self._size - 1
+        self._place(row, None)
+        if row != last:
+            cell = self.cells[last]
+            self._place(last, None)
+            self._place(row, cell)
+            self.ids[row] = self.ids[last]
+            self.latitudes[row] = self.latitudes[last]
+            self.longitudes[row] = self.longitudes[last]
+            self.radii[row] = self.radii[last]
+            self.service_masks[row] = self.service_masks[last]
+            self.payloads[row] = self.payloads[last]
+            self._index[int(self.ids[row])] = row
+        self.payloads[last] = None
+        self._size = last
+
+    def load(self):
+        """
+        Rebuild the snapshot from the database. The new copy is built aside
+        and swapped in, so searches keep using the old one until it is ready.
+        """
+        users = list(self._queryset())
+        fresh = TherapistSnapshot(max(1024, len(users) * 2))
+        for user in users:
+            fresh._put(user)
+        with self._lock:
+            for name in self._STATE:
+                setattr(self, name, getattr(fresh, name))
+            self.loaded_at = time.monotonic()
+        logger.info(f"[TherapistSnapshot] Loaded {len(users)} available therapists")
+
+    def shows(self, user_id, **fields):
+        """
+        Whether the snapshot is loaded and either holds no row for the
+        therapist or one whose payload already has these values
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return False
+            row = self._index.get(user_id)
+            if row is None:
+                return True
+            payload = self.payloads[row]
+            return all(payload[name] == value for name, value in fields.items())
+
+    def refresh(self, user_id):
+        """Re-read one therapist, adding, updating or dropping their row"""
+        user = self._queryset().filter(id=user_id).first()
+        with self._lock:
+            if user is None:
+                self._remove(user_id)
+            else:
+                self._put(user)
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def is_stale(self, max_age):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > max_age
+
+    def available_therapists(self):
+        with self._lock:
+            return [
+                {'id': p['id'], 'name': p['name'], 'email': p['email']}
+                for p in self.payloads[:self._size]
+            ]
+
+    def _nearby_rows(self, latitude, longitude, radius_km):
+        """Rows in the grid cells a circle of radius_km around the point overlaps, in row order"""
+        (row_min, row_max), cols = cell_ranges(latitude, longitude, radius_km)
+        if cols is None:
+            # The circle reaches a pole or wraps around the antimeridian
+            found = [rows for (r, _), rows in self._buckets.items() if row_min <= r <= row_max]
+        elif (row_max - row_min + 1) * (cols[1] - cols[0] + 1) > len(self._buckets):
+            found = [
+                rows for (r, c), rows in self._buckets.items()
+                if row_min <= r <= row_max and cols[0] <= c <= cols[1]
+            ]
+        else:
+            cells = itertools.product(range(row_min, row_max + 1), range(cols[0], cols[1] + 1))
+            found = [self._buckets[cell] for cell in cells if cell in self._buckets]
+        rows = np.fromiter(itertools.chain.from_iterable(found), dtype=np.int64)
+        rows.sort()
+        return rows
+
+    def _rows_of(self, ids):
+        """Rows of the given therapist ids that are still in the snapshot, in row order"""
+        index = self._index
+        rows = np.fromiter((index[i] for i in ids if i in index), dtype=np.int64)
+        rows.sort()
+        return rows
+
+    def _filter(self, rows, service_mask, match_all, exclude):
+        keep = np.ones(len(rows), dtype=bool)
+        if service_mask:
+            bits = self.service_masks[rows] & service_mask
+            keep &= bits == service_mask if match_all else bits != 0
+        if exclude:
+            keep &= ~np.isin(self.ids[rows], np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+        return rows[keep]
+
+    def nearest(self, latitude, longitude, radius_km, service_mask=0, match_all=False, exclude=None, only=None,
+                k=None):
+        """
+        Return (payload, distance_km) pairs within radius_km of the point,
+        nearest first and at most k of them. A non-zero service_mask keeps
+        only therapists offering at least one of those services, or all of
+        them with match_all. Therapist ids in exclude are skipped; if only
+        is given, just those therapists are measured, at a cost that grows
+        with len(only) rather than with the snapshot.
+        """
+        with self._lock:
+            if only is not None:
+                rows = self._rows_of(only)
+            else:
+                rows = self._nearby_rows(latitude, longitude, radius_km)
+            rows = self._filter(rows, service_mask, match_all, exclude)
+            distances = haversine_many(latitude, longitude, self.latitudes[rows], self.longitudes[rows])
+            within = distances <= radius_km
+            rows = rows[within]
+            distances = distances[within]
+            if k is not None and 0 < k < len(rows):
+                # Only the k nearest need sorting; rows stay in row order for ties
+                nearest = np.sort(np.argpartition(distances, k - 1)[:k])
+                rows = rows[nearest]
+                distances = distances[nearest]
+            order = np.argsort(distances, kind='stable')
+            return [(self.payloads[rows[i]], float(distances[i])) for i in order]
+
+    def nearest_covering(self, latitude, longitude, k, radius_km=None, service_mask=0, match_all=False,
+                         after=None, exclude=None, only=None, slack_km=0.0):
+        """
+        Return up to k (payload, distance_km) pairs for therapists whose own
+        service radius reaches the point, nearest first and ordered by
+        (distance, id). radius_km additionally caps the distance, and
+        after=(distance, id) resumes from the last item of a previous page.
+        exclude and only work as in nearest(). slack_km widens both limits,
+        to find every therapist who may cover some point that close to this one.
+        """
+        with self._lock:
+            n = self._size
+            if not n:
+                return []
+            if only is not None:
+                rows = self._rows_of(only)
+            else:
+                reach = float(self.radii[:n].max())
+                if radius_km is not None:
+                    reach = min(reach, radius_km)
+                rows = self._nearby_rows(latitude, longitude, reach + slack_km)
+            rows = self._filter(rows, service_mask, match_all, exclude)
+            distances = haversine_many(latitude, longitude, self.latitudes[rows], self.longitudes[rows])
+            within = distances <= self.radii[rows] + slack_km
+            if radius_km is not None:
+                within &= distances <= radius_km + slack_km
+            rows = rows[within]
+            distances = distances[within]
+            ids = self.ids[rows]
+
+            candidates = zip(distances.tolist(), ids.tolist(), rows.tolist())
+            if after is not None:
+                candidates = ((d, i, r) for d, i, r in candidates if (d, i) > after)
+            # Bounded heap: O(n log k) instead of sorting every match
+            return [(self.payloads[r], d) for d, i, r in heapq.nsmallest(k, candidates)]
+
+
+therapist_snapshot = TherapistSnapshot()
+_listener = {'thread': None, 'connected': False}
+_listener_lock = threading.Lock()
+_loader = {'thread': None}
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CHANNEL)
+            _listener['connected'] = True
+            # Anything published while we were not subscribed is lost, so
+            # resync from the database once the subscription is live.
+            therapist_snapshot.load()
+            # Do not hold a database connection open while idling on pub/sub
+            connection.close()
+            for message in pubsub.listen():
+                try:
+                    therapist_snapshot.refresh(int(message['data']))
+                finally:
+                    close_old_connections()
+        except Exception as e:
+            logger.warning(f"[TherapistSnapshot] Pub/sub listener error: {e}")
+        finally:
+            _listener['connected'] = False
+            close_old_connections()
+        time.sleep(RECONNECT_DELAY)
+
+
+def _ensure_listener():
+    with _listener_lock:
+        if _listener['thread'] is None:
+            thread = threading.Thread(target=_listen, name='therapist-snapshot-listener', daemon=True)
+            _listener['thread'] = thread
+            thread.start()
+
+
+def _load():
+    try:
+        therapist_snapshot.load()
+    except Exception as e:
+        logger.warning(f"[TherapistSnapshot] Background reload failed: {e}")
+    finally:
+        connection.close()
+
+
+def _reload_in_background():
+    with _listener_lock:
+        thread = _loader['thread']
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_load, name='therapist-snapshot-loader', daemon=True)
+        _loader['thread'] = thread
+        thread.start()
+
+
+def get_snapshot():
+    """
+    Return this worker's snapshot. It is loaded on the spot only when there
+    is none to serve yet; a stale one is served while a background thread
+    reloads it.
+    """
+    _ensure_listener()
+    max_age = MAX_AGE_LISTENING if _listener['connected'] else MAX_AGE_NOT_LISTENING
+    if therapist_snapshot.loaded_at is None:
+        therapist_snapshot.load()
+    elif therapist_snapshot.is_stale(max_age):
+        _reload_in_background()
+    return therapist_snapshot
+
+
+def publish_therapist_change(user_id):
+    """
+    Tell every worker that a therapist's status, location or services
+    changed, and drop cached search results. The local snapshot is
+    refreshed right away so the writer sees its own change even if Redis
+    is unreachable.
+    """
+    if therapist_snapshot.loaded_at is not None:
+        therapist_snapshot.refresh(user_id)
+    search_cache.invalidate()
+    pricing.invalidate(user_id)
+    try:
+        get_redis_connection('default').publish(CHANNEL, str(user_id))
+    except Exception as e:
+        logger.warning(f"[TherapistSnapshot] Could not publish change for therapist {user_id}: {e}")
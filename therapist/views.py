@@ -5,6 +5,7 @@ from django.shortcuts import get_object_or_404
 from User.permissions import IsTherapist
 from .models import TherapistAddress, Services, BankDetails, TherapistStatus
 from .serializers import TherapistAddressSerializer, ServicesSerializer, BankDetailsSerializer, TherapistStatusSerializer
+from .snapshot import publish_therapist_change
 
 @api_view(['GET', 'POST', 'PUT'])
 @permission_classes([IsTherapist])
@@ -24,6 +25,7 @@ def location_view(request):
             ts, created = TherapistStatus.objects.get_or_create(user=request.user)
             ts.status = 'available'
             ts.save()
+            publish_therapist_change(request.user.id)
 
             return Response(serializer.data, status=status.HTTP_201_CREATED if not instance else status.HTTP_200_OK)
 
@@ -41,6 +43,7 @@ def services_view(request):
         serializer = ServicesSerializer(instance, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save(user=request.user)
+            publish_therapist_change(request.user.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED if not instance else status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -80,5 +83,6 @@ def update_therapist_status(request):
     serializer = TherapistStatusSerializer(ts, data=request.data, partial=True)
     if serializer.is_valid():
         serializer.save()
+        publish_therapist_change(request.user.id)
         return Response(serializer.data)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file